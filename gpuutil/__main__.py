@@ -1,7 +1,10 @@
-from gpuutil import GPUStat, loaddict, savedict
+from gpuutil import GPUStat, savedict
+from gpuutil.gpuutil import load_configuration
 import sys
 import argparse
 import os
+import json
+import time
 
 def csv2list(csv):
     l = [col.strip() for col in csv.split(',')]
@@ -12,45 +15,27 @@ def str2bool(s):
     else:
         return False
 
+def parse_time(s):
+    # local time, with or without hours and minutes.
+    if s is None:
+        return None
+    for fmt in ['%Y-%m-%d %H:%M', '%Y-%m-%d']:
+        try:
+            return time.mktime(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError('Unexpected time {0}, use YYYY-MM-DD or "YYYY-MM-DD HH:MM"'.format(s))
+
 def load_config():
     home_dir = os.path.expanduser('~')
     configpath = os.path.join(home_dir, '.gpuutil.conf')
-    if not os.path.isfile(configpath):
-        return {}
-    return loaddict(configpath)
+    # GPUStat has already read it, this does not parse it again.
+    return load_configuration(configpath)
 def save_config(config):
     home_dir = os.path.expanduser('~')
     configdir = os.path.join(home_dir, '.gpuutil.conf')
     savedict(configdir, config)
 
-# style format: |c|l:15|r|c:14rl:13|
-def parse_style(style):
-    if style is None:
-        return None, None
-    components = []
-    limits = []
-    while len(style) > 0:
-        ch = style[0]
-        if ch == '|':
-            components.append(ch)
-            style = style[1:]
-            continue
-        elif ch in ['l', 'r', 'c']:
-            limit = None
-            style = style[1:]
-            if style[0] == ':':
-                style = style[1:]
-                digits = ''
-                while style[0].isdigit():
-                    digits += style[0]
-                    style = style[1:]
-                if digits != '':
-                    limit = int(digits)
-            components.append(ch)
-            limits.append(limit)
-    style = ''.join(components)
-    return style, limits
-
 if __name__ == '__main__':
     stat = GPUStat()
 
@@ -64,10 +49,164 @@ if __name__ == '__main__':
     parser.add_argument('--show-process', '-sp', default=True, type=str2bool, help='whether show process or not')
     parser.add_argument('--vertical', '-v', default=False, type=str2bool, help='whether show each user in different lines. (show user vertically)')
     parser.add_argument('--save', default=False, action="store_true", help='save config to profile')
-    args = parser.parse_args()
+    parser.add_argument('--cache-stats', default=False, action="store_true", help='print the hit/miss/refresh statistics of the shared snapshot cache and exit.')
+    parser.add_argument('--hosts', default=None, type=str, help='a file listing hosts to collect from, shows all of them in one table.')
+    parser.add_argument('--find', default=None, type=int, help='with --hosts, print the FIND freest gpus over all hosts as host:id.')
+    parser.add_argument('--min-free-mem', default=None, type=int, help='with --find, only consider gpus with at least this much free memory (MiB).')
+    parser.add_argument('--format', '-f', default='table', type=str, choices=['table', 'json', 'ndjson', 'csv'], help='print numbers instead of a table, json: a document per sample, ndjson: a line per gpu, csv: a row per gpu.')
+    parser.add_argument('--watch', '-w', default=None, type=float, help='keep refreshing every WATCH seconds using a single nvidia-smi process.')
+    subparsers = parser.add_subparsers(dest='subcommand')
+    wait_parser = subparsers.add_parser('wait', help='wait until enough gpus are available, then print them or run the command given after -- on them.')
+    wait_parser.add_argument('num', type=int, help='number of gpus needed.')
+    wait_parser.add_argument('--timeout', '-t', default=None, type=float, help='give up after this many seconds.')
+    wait_parser.add_argument('--min-free-mem', '-m', default=None, type=int, help='accept gpus in use that still have this much free memory (MiB), by default only gpus without processes are used.')
+    wait_parser.add_argument('--priority', default=0, type=int, help='waiting processes with higher priority get gpus first.')
+    wait_parser.add_argument('--blacklist', '-b', default=[], type=csv2list, help='gpus that should not be used, comma separated.')
+    wait_parser.add_argument('--topology', default=False, action="store_true", help='choose the gpus with the fastest links between them (nvidia-smi topo -m).')
+    place_parser = subparsers.add_parser('place', help='place jobs by the memory they need, prints the gpus of each job (or none) on a line.')
+    place_parser.add_argument('jobs', nargs='+', type=str, help='MiB needed by each job, NUMxMIB for a job on NUM gpus, e.g. 4000 4000 2x16000.')
+    place_parser.add_argument('--policy', default='best_fit', type=str, choices=['best_fit', 'worst_fit', 'spread'], help='best_fit packs jobs on the fullest gpus that fit, worst_fit on the emptiest, spread on the least busy.')
+    place_parser.add_argument('--margin', default=512, type=int, help='MiB to keep free on each gpu.')
+    place_parser.add_argument('--blacklist', '-b', default=[], type=csv2list, help='gpus that should not be used, comma separated.')
+    leases_parser = subparsers.add_parser('leases', help='list the gpus leased to processes on this node.')
+    leases_parser.add_argument('--expire', default=False, action="store_true", help='remove the leases whose owner exited or whose ttl passed.')
+    leases_parser.add_argument('--release', default=None, type=csv2list, help='remove the leases of these gpus (or mig instances, e.g. 0/1), comma separated.')
+    serve_parser = subparsers.add_parser('serve', help='serve prometheus metrics at /metrics and the latest sample at /snapshot.json.')
+    serve_parser.add_argument('--port', default=9400, type=int, help='port to listen on.')
+    serve_parser.add_argument('--bind', default='0.0.0.0', type=str, help='address to listen on.')
+    serve_parser.add_argument('--interval', default=1, type=float, help='seconds between two samples.')
+    account_parser = subparsers.add_parser('account', help='record which user uses which gpu, for report.')
+    account_parser.add_argument('--interval', default=1, type=float, help='seconds between two samples.')
+    report_parser = subparsers.add_parser('report', help='gpu hours, memory and energy per user, from the records of account.')
+    report_parser.add_argument('--since', default=None, type=str, help='start of the range, YYYY-MM-DD or "YYYY-MM-DD HH:MM".')
+    report_parser.add_argument('--until', default=None, type=str, help='end of the range (excluded), same format as --since.')
+    report_parser.add_argument('--month', default=None, type=str, help='report a whole month, YYYY-MM.')
+    report_parser.add_argument('--format', default='table', type=str, choices=['table', 'json'], help='output format.')
+    record_parser = subparsers.add_parser('record', help='record samples into a file that can be replayed with set_redirect --replay.')
+    record_parser.add_argument('path', type=str, help='the file to record into.')
+    record_parser.add_argument('--interval', default=1, type=float, help='seconds between two samples.')
+    record_parser.add_argument('--count', default=None, type=int, help='stop after this many samples.')
+    record_parser.add_argument('--duration', default=None, type=float, help='stop after this many seconds.')
+    alerts_parser = subparsers.add_parser('alerts', help='evaluate the alert rules of ~/.gpuutil.conf on every sample and run their actions.')
+    alerts_parser.add_argument('--interval', default=1, type=float, help='seconds between two samples.')
+    changes_parser = subparsers.add_parser('changes', help='print a json line for every process that starts or exits, and for every change of the given fields.')
+    changes_parser.add_argument('--interval', default=1, type=float, help='seconds between two samples.')
+    changes_parser.add_argument('--fields', default=[], type=csv2list, help='gpu or process fields whose changes are printed too, comma separated, e.g. util,mem_used,vmem.')
+    # everything after -- is a command to run on the chosen gpus.
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--')+1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    if args.subcommand == 'wait':
+        from gpuutil import MoreGPUNeededError, wait_and_set
+        try:
+            # when only printing, the gpus are used by another process, so the
+            # lease can not end with this one.
+            gpus = wait_and_set(args.num, timeout=args.timeout, min_free_mem=args.min_free_mem, blacklist=[int(x) for x in args.blacklist], priority=args.priority, show=False, detach=len(command) == 0, topology=args.topology)
+        except MoreGPUNeededError:
+            sys.stderr.write('Timed out waiting for {0} gpus.\n'.format(args.num))
+            sys.exit(1)
+        if len(command) > 0:
+            os.execvp(command[0], command)
+        print(os.environ['CUDA_VISIBLE_DEVICES'])
+        sys.exit(0)
+    if args.subcommand == 'place':
+        from gpuutil import auto_place
+        jobs = [[int(x) for x in job.split('x')] if 'x' in job else int(job) for job in args.jobs]
+        placements = auto_place(jobs, policy=args.policy, margin=args.margin, blacklist=[int(x) for x in args.blacklist])
+        for selected in placements:
+            print('none' if selected is None else ','.join(str(x) for x in selected))
+        sys.exit(0 if None not in placements else 1)
+    if args.subcommand == 'leases':
+        from gpuutil.gpuutil import LeaseManager
+        leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+        if args.release is not None:
+            # mig instances are released by their id, e.g. 0/1.
+            leases.release([int(x) if x.isdigit() else x for x in args.release])
+        if args.expire:
+            leases.expire()
+        now = time.time()
+        lines = ['GPU\tUser\tHost\tPID\tAge\tExpires\tState']
+        for lease in leases.leases():
+            lines.append('{0}\t{1}\t{2}\t{3}\t{4:.0f}s\t{5:.0f}s\t{6}'.format(
+                lease['gpu'], lease['user'], lease['host'], 'N/A' if lease['pid'] is None else lease['pid'],
+                now - lease['created'], lease['expires'] - now, 'valid' if lease['valid'] else 'expired'))
+        print('\n'.join(lines).expandtabs(12))
+        sys.exit(0)
+    if args.subcommand == 'serve':
+        from gpuutil.exporter import serve
+        try:
+            serve(stat, args.port, args.bind, args.interval)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.subcommand == 'account':
+        from gpuutil.accounting import AccountingLog, record_accounting
+        try:
+            record_accounting(stat, AccountingLog(stat.accounting_dir), args.interval)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.subcommand == 'report':
+        from gpuutil.accounting import AccountingLog, summarize
+        from gpuutil.gpuutil import draw_table
+        since = parse_time(args.since)
+        until = parse_time(args.until)
+        if args.month is not None:
+            since = parse_time(args.month + '-01')
+            year, month = [int(x) for x in args.month.split('-')]
+            until = parse_time('{0:04d}-{1:02d}-01'.format(year + month // 12, month % 12 + 1))
+        summary = summarize(AccountingLog(stat.accounting_dir), since, until)
+        users = sorted(summary, key=lambda user:summary[user]['gpu_hours'], reverse=True)
+        if args.format == 'json':
+            print(json.dumps(summary, indent=4))
+        else:
+            table = [['User', 'GPU hours', 'Memory GiB*h', 'Energy kWh']]
+            for user in users:
+                table.append([user, '{0:.2f}'.format(summary[user]['gpu_hours']), '{0:.2f}'.format(summary[user]['memory_gib_hours']), '{0:.3f}'.format(summary[user]['energy_kwh'])])
+            print(draw_table(table, rowsty='|c|{0}|'.format('c'*(len(table)-1)), colsty='|l|r|r|r|'))
+        sys.exit(0)
+    if args.subcommand == 'record':
+        from gpuutil.replay import record_snapshots
+        try:
+            record_snapshots(stat, args.path, args.interval, args.count, args.duration)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.subcommand == 'changes':
+        stat.incremental = True
+        try:
+            for snapshot in stat.watch(args.interval):
+                if stat.diff is None:
+                    continue
+                for event in stat.diff.events(args.fields):
+                    print(json.dumps(event), flush=True)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        sys.exit(0)
+    if args.subcommand == 'alerts':
+        from gpuutil.alerts import AlertEngine, run_alerts
+        engine = AlertEngine.from_config(stat.alerts)
+        if len(engine.rules) == 0:
+            raise ValueError('No alert rules, add an "alerts" section to ~/.gpuutil.conf.')
+        try:
+            run_alerts(stat, engine, args.interval)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.cache_stats:
+        if stat.cache is None:
+            raise ValueError('The snapshot cache is not enabled, add a "cache" section to ~/.gpuutil.conf.')
+        print(stat.cache.load_stats())
+        sys.exit(0)
     cols = args.cols if args.cols is not None else recommended_cols
     show_process = args.show_process
-    style, limit = parse_style(args.style)
+    style, limit = None, None
+    if args.style is not None:
+        from gpuutil.plans import parse_style
+        style, limit = parse_style(args.style)
     vertical = args.vertical
     unexpected_cols = []
     for col in cols:
@@ -88,22 +227,49 @@ if __name__ == '__main__':
         config = load_config()
         config[profile] = params
         save_config(config)
-    elif args.profile is not None:
-        config = load_config()
-        if args.profile in config:
-            params = config[args.profile]
-            cols = params["cols"]
-            show_process = params["show-process"]
-            style = None
-            limit = None
-            vertical = False
-            if "style" in params:
-                style = params["style"]
-            if "limit" in params:
-                limit = params["limit"]
-            if "vertical" in params:
-                vertical = params["vertical"]
-
+        from gpuutil.plans import compile_plans
+        compile_plans()
+    plan = None
+    if args.profile is not None and not args.save:
+        # the profile as it was compiled when the config last changed.
+        from gpuutil.plans import load_plan
+        plan = load_plan(args.profile)
+        if plan is None:
+            raise ValueError('Profile do not exist.\nAvaliable Profiles:{0}'.format(','.join(list(load_config().keys()))))
+        cols, style, limit, show_process, vertical = plan.cols, plan.colsty, plan.colsz, plan.show_command, plan.vertical
+    if args.hosts is not None:
+        from gpuutil.cluster import ClusterStat, load_hosts
+        cluster = ClusterStat(load_hosts(args.hosts))
+        if args.find is not None:
+            cluster.parse()
+            for host, gpu_id in cluster.find_free_gpus(args.find, args.min_free_mem):
+                print('{0}:{1}'.format(host, gpu_id))
         else:
-            raise ValueError('Profile do not exist.\nAvaliable Profiles:{0}'.format(','.join(list(config.keys()))))
-    stat.show(enabled_cols = cols, colsty=style, colsz=limit, vertical=vertical, show_command=show_process)
\ No newline at end of file
+            cluster.show(enabled_cols = cols, colsty=style, colsz=limit, vertical=vertical, show_command=show_process)
+    elif args.format != 'table':
+        from gpuutil.gpuutil import RecordWriter
+        writer = RecordWriter(args.format, enabled_cols=cols)
+        try:
+            if args.watch is not None:
+                for snapshot in stat.watch(args.watch):
+                    writer.write(snapshot)
+            else:
+                stat.parse()
+                writer.write(stat.snapshot)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+    elif args.watch is not None:
+        from gpuutil.live import LiveRenderer
+        renderer = LiveRenderer(enabled_cols = cols, colsty=style, colsz=limit, vertical=vertical, show_command=show_process)
+        try:
+            for snapshot in stat.watch(args.watch):
+                # only the cells that changed since the last sample are written.
+                sys.stdout.write(renderer.frame(snapshot))
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+    elif plan is not None:
+        stat.parse()
+        print(plan.render(stat.snapshot))
+    else:
+        stat.show(enabled_cols = cols, colsty=style, colsz=limit, vertical=vertical, show_command=show_process)
\ No newline at end of file
@@ -0,0 +1,193 @@
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import time
+from gpuutil.gpuutil import loaddict, savedict, uid2name
+try:
+    import pwd
+except ImportError:
+    pwd = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# one record per process per sample, or one per idle gpu (pid 0, uid idle_uid).
+# duration is the time the sample stands for, nproc the number of processes
+# on the gpu at that time, power and util are the gpu's.
+record_format = '<dfhhiifff'
+record_fields = ['timestamp', 'duration', 'gpu', 'nproc', 'pid', 'uid', 'vmem', 'power', 'util']
+record_size = struct.calcsize(record_format)
+record_struct = struct.Struct(record_format)
+if np is not None:
+    record_dtype = np.dtype([('timestamp', '<f8'), ('duration', '<f4'), ('gpu', '<i2'), ('nproc', '<i2'), ('pid', '<i4'),
+                             ('uid', '<i4'), ('vmem', '<f4'), ('power', '<f4'), ('util', '<f4')])
+
+idle_uid = -1
+# users without a local uid (e.g. from a redirected ps output) get ids from here on.
+first_named_uid = 1 << 30
+nan = float('nan')
+
+def default_accounting_dir():
+    return os.path.expanduser('~/.gpuutil-accounting')
+
+class AccountingLog():
+    # fixed size binary records appended to one file per month, so a range of
+    # time is found by bisection and read through mmap without parsing.
+    def __init__(self, directory=None):
+        self.directory = default_accounting_dir() if directory is None else os.path.expanduser(directory)
+        self.users_path = os.path.join(self.directory, 'users.json')
+        self.users = None
+        self.file = None
+        self.file_path = None
+    def path(self, timestamp):
+        return os.path.join(self.directory, time.strftime('%Y-%m', time.localtime(timestamp)) + '.bin')
+    def files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.bin'))
+    def load_users(self):
+        if self.users is None:
+            self.users = loaddict(self.users_path) if os.path.isfile(self.users_path) else {}
+        return self.users
+    def user_id(self, proc):
+        if proc.uid is not None:
+            return int(proc.uid)
+        if pwd is not None:
+            try:
+                return pwd.getpwnam(proc.user).pw_uid
+            except (KeyError, TypeError):
+                pass
+        users = self.load_users()
+        if proc.user not in users:
+            users[proc.user] = first_named_uid + len(users)
+            savedict(self.users_path, users)
+        return users[proc.user]
+    def user_name(self, uid):
+        if uid == idle_uid:
+            return '(idle)'
+        if uid >= first_named_uid:
+            names = {value: key for key, value in self.load_users().items()}
+            return names.get(uid, str(uid))
+        return uid2name(uid)
+    def records(self, snapshot, duration):
+        records = []
+        for gpu in snapshot.devices:
+            power = nan if gpu.power is None else gpu.power
+            util = nan if gpu.util is None else gpu.util
+            nproc = len(gpu.processes)
+            if nproc == 0:
+                records.append(record_struct.pack(snapshot.timestamp, duration, gpu.id, 0, 0, idle_uid, 0, power, util))
+            for proc in gpu.processes:
+                pid = int(proc.pid) if str(proc.pid).isdigit() else 0
+                vmem = nan if proc.vmem is None else proc.vmem
+                records.append(record_struct.pack(snapshot.timestamp, duration, gpu.id, nproc, pid, self.user_id(proc), vmem, power, util))
+        return b''.join(records)
+    def append(self, snapshot, duration):
+        # a sample is written at once, so readers never see half of it.
+        path = self.path(snapshot.timestamp)
+        if path != self.file_path:
+            self.close()
+            os.makedirs(self.directory, exist_ok=True)
+            self.file = open(path, 'ab')
+            self.file_path = path
+        self.file.write(self.records(snapshot, duration))
+        self.file.flush()
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.file_path = None
+
+class RecordTimestamps():
+    # the timestamps of the records in a buffer, as a sequence for bisect.
+    def __init__(self, buffer, count):
+        self.buffer = buffer
+        self.count = count
+    def __len__(self):
+        return self.count
+    def __getitem__(self, i):
+        return struct.unpack_from('<d', self.buffer, i * record_size)[0]
+
+def find_record(buffer, count, timestamp):
+    # index of the first record at or after timestamp, records are in time order.
+    return bisect_left(RecordTimestamps(buffer, count), timestamp)
+
+def summarize(log, since=None, until=None):
+    # {user: {'gpu_hours', 'memory_gib_hours', 'energy_kwh'}} over [since, until).
+    # a gpu shared by n processes counts 1/n for each of them.
+    since = 0 if since is None else since
+    until = float('inf') if until is None else until
+    totals = {}
+    for path in log.files():
+        size = os.path.getsize(path)
+        count = size // record_size
+        if count == 0:
+            continue
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), count * record_size, access=mmap.ACCESS_READ)
+            try:
+                start = find_record(buffer, count, since)
+                end = find_record(buffer, count, until)
+                if start < end:
+                    add_totals(totals, buffer, start, end)
+            finally:
+                buffer.close()
+    return {log.user_name(uid): values for uid, values in totals.items()}
+
+def add_totals(totals, buffer, start, end):
+    if np is not None:
+        # the records are used in place, with one pass per reduction.
+        records = np.frombuffer(buffer, dtype=record_dtype, count=end - start, offset=start * record_size)
+        share = records['duration'].astype(np.float64) / np.maximum(records['nproc'], 1)
+        uids, inverse = np.unique(records['uid'], return_inverse=True)
+        gpu_seconds = np.bincount(inverse, weights=share)
+        memory = np.bincount(inverse, weights=np.nan_to_num(records['vmem'].astype(np.float64)) * records['duration'])
+        energy = np.bincount(inverse, weights=np.nan_to_num(records['power'].astype(np.float64)) * share)
+        del records
+        for i, uid in enumerate(uids.tolist()):
+            add_user(totals, uid, gpu_seconds[i], memory[i], energy[i])
+        return
+    gpu_seconds = {}
+    memory = {}
+    energy = {}
+    view = memoryview(buffer)[start * record_size:end * record_size]
+    try:
+        for timestamp, duration, gpu, nproc, pid, uid, vmem, power, util in record_struct.iter_unpack(view):
+            share = duration / max(nproc, 1)
+            if uid not in gpu_seconds:
+                gpu_seconds[uid] = memory[uid] = energy[uid] = 0
+            gpu_seconds[uid] += share
+            # nan != nan, those values were not available.
+            if vmem == vmem:
+                memory[uid] += vmem * duration
+            if power == power:
+                energy[uid] += power * share
+    finally:
+        view.release()
+    for uid in gpu_seconds:
+        add_user(totals, uid, gpu_seconds[uid], memory[uid], energy[uid])
+
+def add_user(totals, uid, gpu_seconds, memory, energy):
+    # memory in MiB*seconds, energy in joules.
+    if uid not in totals:
+        totals[uid] = {'gpu_hours': 0, 'memory_gib_hours': 0, 'energy_kwh': 0}
+    totals[uid]['gpu_hours'] += float(gpu_seconds) / 3600
+    totals[uid]['memory_gib_hours'] += float(memory) / 1024 / 3600
+    totals[uid]['energy_kwh'] += float(energy) / 3.6e6
+
+def record_accounting(stat, log, interval=1):
+    # append a sample every interval seconds until interrupted. a sample stands
+    # for the time since the previous one, but at most two intervals, so that
+    # gaps (e.g. the recorder was stopped) are not counted.
+    last = None
+    samples = stat.watch(interval)
+    try:
+        for snapshot in samples:
+            duration = interval if last is None else min(snapshot.timestamp - last, 2 * interval)
+            last = snapshot.timestamp
+            log.append(snapshot, duration)
+    finally:
+        samples.close()
+        log.close()
@@ -0,0 +1,232 @@
+import json
+import re
+import sys
+import threading
+import time
+from gpuutil.gpuutil import GPUDevice
+
+# a rule, in the "alerts" section of ~/.gpuutil.conf:
+#   {"name": "stuck", "scope": "gpu", "when": [["util", "<=", 0], ["mem_used", ">", 1000]],
+#    "for": 1800, "clear": [["util", ">", 10]], "clear_for": 60, "actions": ["log", "page"]}
+# it fires once all conditions of when held for `for` seconds on a gpu (or a
+# process, with "scope": "process"), and resolves once the conditions of clear
+# (by default: when does not hold) held for clear_for seconds. a condition
+# compares a field with a number, a string or another field.
+gpu_fields = ['gpu', 'name', 'uuid'] + list(GPUDevice.units) + ['mem_percent', 'temp_margin', 'nproc']
+process_fields = gpu_fields + ['pid', 'process', 'user', 'vmem', 'command']
+
+def compare(op, a, b):
+    if a is None or b is None:
+        return False
+    if op == 'matches':
+        return re.search(b, str(a)) is not None
+    if op == 'in':
+        return a in b
+    try:
+        return operators[op](a, b)
+    except TypeError:
+        return False
+
+operators = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+condition_ops = list(operators) + ['in', 'matches']
+
+def gpu_rule_values(gpu):
+    values = {'gpu': gpu.id, 'name': gpu.name, 'uuid': gpu.uuid, 'nproc': len(gpu.processes)}
+    for field in GPUDevice.units:
+        values[field] = getattr(gpu, field)
+    values['mem_percent'] = None if not gpu.mem_total or gpu.mem_used is None else gpu.mem_used * 100 / gpu.mem_total
+    values['temp_margin'] = None if gpu.temp is None or gpu.temp_max is None else gpu.temp_max - gpu.temp
+    return values
+
+def process_rule_values(gpu, values, proc):
+    values = dict(values)
+    values.update({'pid': proc.pid, 'process': proc.name, 'user': proc.user, 'vmem': proc.vmem, 'command': proc.command})
+    return values
+
+class Placeholders(dict):
+    # message templates show N/A for fields that are not there.
+    def __missing__(self, key):
+        return 'N/A'
+
+class AlertRule():
+    def __init__(self, config):
+        self.name = config['name']
+        self.scope = config.get('scope', 'gpu')
+        if self.scope not in ['gpu', 'process']:
+            raise ValueError('Unknown scope {0} in alert {1}, avaliable: gpu,process'.format(self.scope, self.name))
+        self.fields = gpu_fields if self.scope == 'gpu' else process_fields
+        self.when = [self.check(condition) for condition in config['when']]
+        self.clear = None if config.get('clear') is None else [self.check(condition) for condition in config['clear']]
+        self.duration = config.get('for', 0)
+        self.clear_duration = config.get('clear_for', 0)
+        self.actions = config.get('actions', ['log'])
+        default_message = '{rule} {state} on gpu {gpu}' if self.scope == 'gpu' else '{rule} {state} on gpu {gpu}, pid {pid} of {user}'
+        self.message = config.get('message', default_message)
+    def check(self, condition):
+        field, op, value = condition
+        if field not in self.fields:
+            raise ValueError('Unknown field {0} in alert {1}, avaliable: {2}'.format(field, self.name, ','.join(self.fields)))
+        if op not in condition_ops:
+            raise ValueError('Unknown operator {0} in alert {1}, avaliable: {2}'.format(op, self.name, ','.join(condition_ops)))
+        return (field, op, value)
+    def holds(self, conditions, values):
+        for field, op, value in conditions:
+            # a string that names a field compares with that field.
+            if isinstance(value, str) and value in self.fields:
+                value = values[value]
+            if not compare(op, values[field], value):
+                return False
+        return True
+    def targets(self, snapshot):
+        # (key, values) of every gpu or process the rule looks at.
+        for gpu in snapshot.devices:
+            values = gpu_rule_values(gpu)
+            if self.scope == 'gpu':
+                yield gpu.id, values
+            else:
+                for proc in gpu.processes:
+                    yield (gpu.id, proc.pid), process_rule_values(gpu, values, proc)
+
+class AlertState():
+    __slots__ = ['since', 'firing', 'clear_since', 'values']
+    def __init__(self):
+        self.since = None
+        self.firing = False
+        self.clear_since = None
+        self.values = None
+
+class AlertEngine():
+    # evaluates the rules on every new snapshot. only the state of each rule on
+    # each gpu (or process) present in the last snapshot is kept, so a sample
+    # costs O(rules x gpus) whatever the windows of the rules are.
+    def __init__(self, rules, actions=None):
+        self.rules = [rule if isinstance(rule, AlertRule) else AlertRule(rule) for rule in rules]
+        self.actions = {'log': {'type': 'log'}}
+        if actions is not None:
+            self.actions.update(actions)
+        for name, action in self.actions.items():
+            if action.get('type') not in action_types:
+                raise ValueError('Unknown type {0} of action {1}, avaliable: {2}'.format(action.get('type'), name, ','.join(action_types)))
+        for rule in self.rules:
+            for name in rule.actions:
+                if name not in self.actions:
+                    raise ValueError('Unknown action {0} in alert {1}, avaliable: {2}'.format(name, rule.name, ','.join(self.actions)))
+        self.states = [{} for _ in self.rules]
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('rules', []), config.get('actions'))
+    def firing(self):
+        # (rule name, key) of the alerts that are firing now.
+        return [(rule.name, key) for rule, states in zip(self.rules, self.states) for key, state in states.items() if state.firing]
+    def evaluate(self, snapshot):
+        # returns the events of this snapshot, after running their actions.
+        if snapshot.partial and len(snapshot.devices) == 0:
+            # nvidia-smi failed or timed out, that says nothing about the gpus:
+            # the alerts and their windows carry on with the next good sample.
+            return []
+        now = snapshot.timestamp
+        events = []
+        for rule, states in zip(self.rules, self.states):
+            seen = set()
+            for key, values in rule.targets(snapshot):
+                seen.add(key)
+                if key not in states:
+                    states[key] = AlertState()
+                state = states[key]
+                state.values = values
+                if not state.firing:
+                    if not rule.holds(rule.when, values):
+                        state.since = None
+                        continue
+                    if state.since is None:
+                        state.since = now
+                    if now - state.since >= rule.duration:
+                        state.firing = True
+                        state.clear_since = None
+                        events.append(self.event(rule, 'firing', state, now))
+                else:
+                    cleared = not rule.holds(rule.when, values) if rule.clear is None else rule.holds(rule.clear, values)
+                    if not cleared:
+                        state.clear_since = None
+                        continue
+                    if state.clear_since is None:
+                        state.clear_since = now
+                    if now - state.clear_since >= rule.clear_duration:
+                        events.append(self.event(rule, 'resolved', state, now))
+                        del states[key]
+            # the gpu or the process is gone.
+            for key in [key for key in states if key not in seen]:
+                if states[key].firing:
+                    events.append(self.event(rule, 'resolved', states[key], now))
+                del states[key]
+        for rule, event in events:
+            self.dispatch(rule, event)
+        return [event for rule, event in events]
+    def event(self, rule, state_name, state, now):
+        event = dict(state.values)
+        event.update({'rule': rule.name, 'state': state_name, 'timestamp': now, 'since': state.since})
+        event['message'] = rule.message.format_map(Placeholders(event))
+        return rule, event
+    def dispatch(self, rule, event):
+        for name in rule.actions:
+            action = self.actions[name]
+            try:
+                action_types[action['type']](action, event)
+            except Exception as e:
+                sys.stderr.write('Alert action {0} failed: {1}\n'.format(name, e))
+
+def log_action(action, event):
+    line = '{0} {1} {2}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp'])), event['state'].upper(), event['message'])
+    if action.get('path') is None:
+        sys.stderr.write(line)
+        sys.stderr.flush()
+    else:
+        with open(action['path'], 'a') as f:
+            f.write(line)
+
+def in_background(func, *args, **kwargs):
+    # slow hooks must not hold back the next sample.
+    def run():
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            sys.stderr.write('Alert action failed: {0}\n'.format(e))
+    threading.Thread(target=run, daemon=True).start()
+
+def command_action(action, event):
+    # the arguments are formatted with the event, which is also in $GPUUTIL_ALERT as json.
+    import os
+    import shlex
+    import subprocess
+    command = [arg.format_map(Placeholders(event)) for arg in shlex.split(action['command'])]
+    env = dict(os.environ)
+    env['GPUUTIL_ALERT'] = json.dumps(event)
+    in_background(subprocess.run, command, env=env, timeout=action.get('timeout', 60))
+
+def webhook_action(action, event):
+    # posts the event as json.
+    from urllib.request import Request, urlopen
+    request = Request(action['url'], data=json.dumps(event).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    in_background(lambda: urlopen(request, timeout=action.get('timeout', 10)).close())
+
+# action type -> function(action config, event), add one here to plug in another kind of action.
+action_types = {
+    'log': log_action,
+    'command': command_action,
+    'webhook': webhook_action,
+}
+
+def run_alerts(stat, engine, interval=1):
+    samples = stat.watch(interval)
+    try:
+        for snapshot in samples:
+            engine.evaluate(snapshot)
+    finally:
+        samples.close()
@@ -0,0 +1,2 @@
+from gpuutil.benchmark.fixtures import generate_nvsmi_xml, generate_mig_list, generate_ps_output
+from gpuutil.benchmark.suite import FixtureHome, run_suite, compare, check_startup, format_report
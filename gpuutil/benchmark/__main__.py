@@ -0,0 +1,42 @@
+from gpuutil import loaddict, savedict
+from gpuutil.benchmark.suite import default_gpus, default_procs, default_import_budget, run_suite, compare, check_startup, format_report, log_to_stderr
+import argparse
+import json
+import sys
+
+def csv2ints(csv):
+    return [int(x) for x in csv.split(',') if x.strip() != '']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measure the overhead of gpuutil on synthetic nvidia-smi and ps outputs.')
+    parser.add_argument('--gpus', default=default_gpus, type=csv2ints, help='numbers of gpus to generate, comma separated.')
+    parser.add_argument('--procs', default=default_procs, type=csv2ints, help='numbers of compute processes to generate, comma separated.')
+    parser.add_argument('--repeat', '-r', default=10, type=int, help='how many times each stage is timed.')
+    parser.add_argument('--output', '-o', default=None, type=str, help='save the results as json to this file.')
+    parser.add_argument('--baseline', '-b', default=None, type=str, help='a json file saved by --output to compare with.')
+    parser.add_argument('--threshold', default=0.2, type=float, help='relative slowdown of a median that counts as a regression.')
+    parser.add_argument('--import-budget', default=default_import_budget, type=float, help='fail if import gpuutil adds more than this many milliseconds to the start of python.')
+    parser.add_argument('--startup-only', default=False, action='store_true', help='only measure the startup, e.g. to check the import budget quickly.')
+    parser.add_argument('--json', default=False, action='store_true', help='print the results as json instead of a summary.')
+    args = parser.parse_args()
+
+    if args.startup_only:
+        args.gpus = []
+    report = run_suite(args.gpus, args.procs, args.repeat, log=log_to_stderr)
+    baseline = loaddict(args.baseline) if args.baseline is not None else None
+    if args.output is not None:
+        savedict(args.output, report)
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print(format_report(report, baseline))
+    failed = False
+    for problem in check_startup(report, args.import_budget):
+        print('STARTUP ' + problem)
+        failed = True
+    if baseline is not None:
+        for case, stage, before, after in compare(report, baseline, args.threshold):
+            print('REGRESSION {0} {1}: {2:.3f} ms -> {3:.3f} ms'.format(case, stage, before, after))
+            failed = True
+    if failed:
+        sys.exit(1)
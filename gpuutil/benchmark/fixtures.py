@@ -0,0 +1,239 @@
+import random
+
+# synthetic outputs of nvidia-smi -q -x and ps, shaped like those of a real
+# driver (including the large supported_clocks section), so that gpuutil can
+# be measured on a machine without gpus.
+
+gpu_template = '''	<gpu id="00000000:{bus:02X}:00.0">
+		<product_name>NVIDIA A100-SXM4-80GB</product_name>
+		<product_brand>NVIDIA</product_brand>
+		<display_mode>Disabled</display_mode>
+		<persistence_mode>Enabled</persistence_mode>
+{mig}		<uuid>{uuid}</uuid>
+		<minor_number>{index}</minor_number>
+		<pci>
+			<pci_bus>{bus:02X}</pci_bus>
+			<pci_device>00</pci_device>
+			<pci_domain>0000</pci_domain>
+			<pci_bus_id>00000000:{bus:02X}:00.0</pci_bus_id>
+			<pci_gpu_link_info>
+				<pcie_gen>
+					<max_link_gen>4</max_link_gen>
+					<current_link_gen>4</current_link_gen>
+				</pcie_gen>
+				<link_widths>
+					<max_link_width>16x</max_link_width>
+					<current_link_width>16x</current_link_width>
+				</link_widths>
+			</pci_gpu_link_info>
+			<tx_util>{tx} KB/s</tx_util>
+			<rx_util>{rx} KB/s</rx_util>
+		</pci>
+		<fan_speed>N/A</fan_speed>
+		<performance_state>P0</performance_state>
+		<fb_memory_usage>
+			<total>81920 MiB</total>
+			<used>{mem_used} MiB</used>
+			<free>{mem_free} MiB</free>
+		</fb_memory_usage>
+		<bar1_memory_usage>
+			<total>131072 MiB</total>
+			<used>1 MiB</used>
+			<free>131071 MiB</free>
+		</bar1_memory_usage>
+		<compute_mode>Default</compute_mode>
+		<utilization>
+			<gpu_util>{util} %</gpu_util>
+			<memory_util>{mem_util} %</memory_util>
+			<encoder_util>0 %</encoder_util>
+			<decoder_util>0 %</decoder_util>
+		</utilization>
+		<ecc_errors>
+			<volatile>
+				<sram_correctable>0</sram_correctable>
+				<sram_uncorrectable>0</sram_uncorrectable>
+				<dram_correctable>0</dram_correctable>
+				<dram_uncorrectable>0</dram_uncorrectable>
+			</volatile>
+		</ecc_errors>
+		<temperature>
+			<gpu_temp>{temp} C</gpu_temp>
+			<gpu_temp_max_threshold>92 C</gpu_temp_max_threshold>
+			<gpu_temp_slow_threshold>89 C</gpu_temp_slow_threshold>
+			<gpu_temp_max_gpu_threshold>N/A</gpu_temp_max_gpu_threshold>
+			<memory_temp>{temp} C</memory_temp>
+		</temperature>
+		<power_readings>
+			<power_state>P0</power_state>
+			<power_management>Supported</power_management>
+			<power_draw>{power:.2f} W</power_draw>
+			<power_limit>400.00 W</power_limit>
+			<default_power_limit>400.00 W</default_power_limit>
+			<enforced_power_limit>400.00 W</enforced_power_limit>
+		</power_readings>
+		<clocks>
+			<graphics_clock>{clock} MHz</graphics_clock>
+			<sm_clock>{clock} MHz</sm_clock>
+			<mem_clock>1593 MHz</mem_clock>
+			<video_clock>1275 MHz</video_clock>
+		</clocks>
+		<max_clocks>
+			<graphics_clock>1410 MHz</graphics_clock>
+			<sm_clock>1410 MHz</sm_clock>
+			<mem_clock>1593 MHz</mem_clock>
+			<video_clock>1290 MHz</video_clock>
+		</max_clocks>
+		<supported_clocks>
+			<supported_mem_clock>
+				<value>1593 MHz</value>
+{supported_clocks}			</supported_mem_clock>
+		</supported_clocks>
+		<processes>
+{processes}		</processes>
+	</gpu>
+'''
+
+mig_disabled = '''		<mig_mode>
+			<current_mig>Disabled</current_mig>
+			<pending_mig>Disabled</pending_mig>
+		</mig_mode>
+		<mig_devices>None</mig_devices>
+'''
+
+mig_enabled_template = '''		<mig_mode>
+			<current_mig>Enabled</current_mig>
+			<pending_mig>Enabled</pending_mig>
+		</mig_mode>
+		<mig_devices>
+{devices}		</mig_devices>
+'''
+
+mig_device_template = '''			<mig_device>
+				<index>{index}</index>
+				<gpu_instance_id>{gpu_instance}</gpu_instance_id>
+				<compute_instance_id>0</compute_instance_id>
+				<device_attributes>
+					<shared>
+						<multiprocessor_count>{sm_count}</multiprocessor_count>
+						<copy_engine_count>{copy_engines}</copy_engine_count>
+						<encoder_count>0</encoder_count>
+						<decoder_count>{copy_engines}</decoder_count>
+						<ofa_count>0</ofa_count>
+						<jpg_count>0</jpg_count>
+					</shared>
+				</device_attributes>
+				<ecc_error_count>
+					<volatile_count>
+						<sram_uncorrectable>0</sram_uncorrectable>
+					</volatile_count>
+				</ecc_error_count>
+				<fb_memory_usage>
+					<total>{mem_total} MiB</total>
+					<used>{mem_used} MiB</used>
+					<free>{mem_free} MiB</free>
+				</fb_memory_usage>
+				<bar1_memory_usage>
+					<total>32767 MiB</total>
+					<used>0 MiB</used>
+					<free>32767 MiB</free>
+				</bar1_memory_usage>
+			</mig_device>
+'''
+
+# (profile, gpu instance id, sm count, MiB) of an 80GB A100 split as 3g+2g+1g+1g.
+mig_layout = [
+    ('3g.40gb', 2, 42, 40192),
+    ('2g.20gb', 3, 28, 19968),
+    ('1g.10gb', 9, 14, 9728),
+    ('1g.10gb', 10, 14, 9728),
+]
+
+process_template = '''			<process_info>
+				<gpu_instance_id>{gpu_instance}</gpu_instance_id>
+				<compute_instance_id>{compute_instance}</compute_instance_id>
+				<pid>{pid}</pid>
+				<type>C</type>
+				<process_name>python</process_name>
+				<used_memory>{mem} MiB</used_memory>
+			</process_info>
+'''
+
+users = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+first_pid = 10000
+
+def assign_processes(num_gpus, num_procs):
+    # round robin over all gpus but the last, which stays free for selection.
+    busy = max(1, num_gpus - 1)
+    return [[first_pid + p for p in range(num_procs) if p % busy == g] for g in range(num_gpus)]
+
+def gpu_uuid(index, seed):
+    return 'GPU-{0:08x}-0000-0000-0000-{1:012x}'.format(index, seed)
+
+def generate_mig(pids, mems):
+    # the mig block of a gpu split as mig_layout, and the instance of each
+    # process. processes go round robin over all instances but the last one.
+    instances = [[] for _ in mig_layout]
+    for i, (pid, mem) in enumerate(zip(pids, mems)):
+        instances[i % (len(mig_layout) - 1)].append(mem)
+    devices = []
+    gpu_instances = []
+    for index, ((profile, gpu_instance, sm_count, mem_total), used) in enumerate(zip(mig_layout, instances)):
+        mem_used = min(sum(used) + 13, mem_total)
+        devices.append(mig_device_template.format(index=index, gpu_instance=gpu_instance, sm_count=sm_count,
+                       copy_engines=sm_count // 14, mem_total=mem_total, mem_used=mem_used, mem_free=mem_total - mem_used))
+    for i in range(len(pids)):
+        gpu_instances.append(mig_layout[i % (len(mig_layout) - 1)][1])
+    return mig_enabled_template.format(devices=''.join(devices)), gpu_instances
+
+def generate_nvsmi_xml(num_gpus, num_procs, seed=0, mig_gpus=0):
+    # the first mig_gpus gpus have mig enabled, see mig_layout.
+    rnd = random.Random(seed)
+    supported_clocks = ''.join('\t\t\t\t<supported_graphics_clock>{0} MHz</supported_graphics_clock>\n'.format(1410 - 15 * i) for i in range(81))
+    gpus = []
+    for index, pids in enumerate(assign_processes(num_gpus, num_procs)):
+        mems = [rnd.randint(100, 2000) for _ in pids]
+        mem_used = min(sum(mems), 81000)
+        mig = mig_disabled
+        gpu_instances = ['N/A'] * len(pids)
+        compute_instances = ['N/A'] * len(pids)
+        if index < mig_gpus:
+            mig, gpu_instances = generate_mig(pids, mems)
+            compute_instances = [0] * len(pids)
+        gpus.append(gpu_template.format(mig=mig,
+            bus=index + 1, index=index, uuid=gpu_uuid(index, seed), tx=rnd.randint(0, 10000), rx=rnd.randint(0, 10000),
+            mem_used=mem_used, mem_free=81920 - mem_used, util=rnd.randint(0, 100) if pids else 0,
+            mem_util=rnd.randint(0, 100) if pids else 0, temp=rnd.randint(30, 80),
+            power=rnd.uniform(50, 400), clock=rnd.randint(210, 1410), supported_clocks=supported_clocks,
+            processes=''.join(process_template.format(pid=pid, mem=mem, gpu_instance=gi, compute_instance=ci)
+                              for pid, mem, gi, ci in zip(pids, mems, gpu_instances, compute_instances))))
+    return '''<?xml version="1.0" ?>
+<!DOCTYPE nvidia_smi_log SYSTEM "nvsmi_device_v11.dtd">
+<nvidia_smi_log>
+	<timestamp>Mon Jan  1 00:00:00 2024</timestamp>
+	<driver_version>535.104.05</driver_version>
+	<cuda_version>12.2</cuda_version>
+	<attached_gpus>{0}</attached_gpus>
+{1}</nvidia_smi_log>
+'''.format(num_gpus, ''.join(gpus))
+
+def generate_mig_list(num_gpus, seed=0, mig_gpus=0):
+    # the output of nvidia-smi -L for generate_nvsmi_xml.
+    lines = []
+    for index in range(num_gpus):
+        lines.append('GPU {0}: NVIDIA A100-SXM4-80GB (UUID: {1})'.format(index, gpu_uuid(index, seed)))
+        if index < mig_gpus:
+            for device, (profile, gpu_instance, sm_count, mem_total) in enumerate(mig_layout):
+                lines.append('  MIG {0:<12} Device {1:>2}: (UUID: MIG-{2:08x}-{3:04x}-0000-0000-{4:012x})'.format(profile, device, index, device, seed))
+    return '\n'.join(lines) + '\n'
+
+def generate_ps_output(num_procs, extra_procs=200, seed=0):
+    # the gpu processes plus unrelated ones, in the format of
+    # ps -axo user:20,pid,args:1024 (the command may contain spaces).
+    rnd = random.Random(seed)
+    lines = ['{0:<20} {1:>7} {2}'.format('USER', 'PID', 'COMMAND')]
+    for pid in range(1, extra_procs + 1):
+        lines.append('{0:<20} {1:>7} {2}'.format('root', pid, '/usr/sbin/daemon --option value'))
+    for p in range(num_procs):
+        command = 'python train.py --config configs/run{0}.yaml --seed {1}'.format(p, rnd.randint(0, 1000))
+        lines.append('{0:<20} {1:>7} {2}'.format(rnd.choice(users), first_pid + p, command))
+    return '\n'.join(lines) + '\n'
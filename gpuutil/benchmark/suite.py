@@ -0,0 +1,170 @@
+from contextlib import redirect_stdout
+import io
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from gpuutil import gpuutil
+from gpuutil.benchmark.fixtures import generate_nvsmi_xml, generate_ps_output
+
+default_gpus = [1, 8, 64]
+default_procs = [0, 500, 5000]
+# milliseconds that `import gpuutil` may add to the start of the interpreter.
+default_import_budget = 30
+# modules that only the functions using them import, see the top of gpuutil.py.
+deferred_modules = ['asyncio', 'concurrent.futures', 'csv', 'xml.etree.ElementTree', 'subprocess', 'random', 'tempfile', 'platform']
+
+class FixtureHome():
+    # a temporary home whose ~/.gpuutil.conf redirects gpuutil to synthetic
+    # outputs, so everything runs through the same code as a docker redirect.
+    def __init__(self, num_gpus, num_procs):
+        self.num_gpus = num_gpus
+        self.num_procs = num_procs
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='gpuutil-bench-')
+        self.nvsmi_path = os.path.join(self.directory, 'nvsmi.xml')
+        self.ps_path = os.path.join(self.directory, 'ps.txt')
+        gpuutil.savefile(self.nvsmi_path, generate_nvsmi_xml(self.num_gpus, self.num_procs))
+        gpuutil.savefile(self.ps_path, generate_ps_output(self.num_procs))
+        gpuutil.savedict(os.path.join(self.directory, '.gpuutil.conf'), {
+            'redirect': {'nvsmi_src': self.nvsmi_path, 'ps_src': self.ps_path},
+            'lease': {'dir': os.path.join(self.directory, 'leases')},
+        })
+        self.environ = {key: os.environ.get(key) for key in ['HOME', 'USERPROFILE']}
+        os.environ['HOME'] = self.directory
+        os.environ['USERPROFILE'] = self.directory
+        return self
+    def __exit__(self, *exc):
+        for key, value in self.environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def measure(func, repeat, setup=None):
+    # milliseconds per call. setup runs before each call and is not timed.
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+
+def bench_case(num_gpus, num_procs, repeat):
+    # one timing per stage of GPUStat.parse, of rendering and of auto_set.
+    results = {}
+    with FixtureHome(num_gpus, num_procs) as home:
+        stat = gpuutil.GPUStat()
+        xml = gpuutil.loadfile(home.nvsmi_path)
+        results['read_xml'] = measure(lambda: gpuutil.loadfile(home.nvsmi_path), repeat)
+        results['parse_xml'] = measure(lambda: stat.load_xml(xml), repeat)
+        results['read_ps'] = measure(lambda: stat.get_process_info(), repeat)
+        process_info = stat.get_process_info()
+        results['build_snapshot'] = measure(lambda: stat.update_gpus(process_info), repeat, setup=lambda: stat.load_xml(xml))
+        results['parse'] = measure(stat.parse, repeat)
+        table = [list(gpuutil.available_cols)] + [[gpuutil.gpu_columns(gpu, False)[key] for key in gpuutil.available_cols] for gpu in stat.snapshot.devices]
+        results['draw_table'] = measure(lambda: gpuutil.draw_table(table, rowsty='|c|{0}|'.format('c'*(len(table)-1))), repeat)
+        results['render'] = measure(lambda: stat.render(), repeat)
+        results['auto_set'] = measure(auto_set_quietly, repeat, setup=release_leases)
+        release_leases()
+    return results
+
+def auto_set_quietly():
+    with redirect_stdout(io.StringIO()):
+        gpuutil.auto_set(1, ask=False, show=False)
+
+def release_leases():
+    stat = gpuutil.GPUStat()
+    gpuutil.LeaseManager(stat.lease_dir).release()
+
+def run_python(code):
+    subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, check=True)
+
+def bench_startup(repeat):
+    # each import runs in a new interpreter, like the cli does.
+    results = {}
+    results['interpreter'] = measure(lambda: run_python('pass'), repeat)
+    results['import'] = measure(lambda: run_python('import gpuutil'), repeat)
+    results['import_overhead'] = {key: results['import'][key] - results['interpreter'][key] for key in results['import']}
+    return results
+
+def loaded_modules(code):
+    output = subprocess.run([sys.executable, '-c', code + '; import sys; print("\\n".join(sys.modules))'], stdout=subprocess.PIPE, check=True)
+    return set(output.stdout.decode('utf-8').split())
+
+def eager_imports():
+    # the deferred modules that `import gpuutil` loads anyway.
+    loaded = loaded_modules('import gpuutil') - loaded_modules('pass')
+    return [module for module in deferred_modules if module in loaded]
+
+def check_startup(report, budget=default_import_budget):
+    # returns a list of problems, empty if the startup is within the budget.
+    problems = []
+    overhead = report['results']['startup']['import_overhead']['median']
+    if overhead > budget:
+        problems.append('import gpuutil takes {0:.1f} ms, the budget is {1} ms'.format(overhead, budget))
+    for module in eager_imports():
+        problems.append('import gpuutil imports {0}'.format(module))
+    return problems
+
+def case_name(num_gpus, num_procs):
+    return '{0}gpus_{1}procs'.format(num_gpus, num_procs)
+
+def run_suite(gpus=default_gpus, procs=default_procs, repeat=10, log=None):
+    if log is not None:
+        log('startup...')
+    results = {'startup': bench_startup(repeat)}
+    for num_gpus in gpus:
+        for num_procs in procs:
+            if log is not None:
+                log('{0}...'.format(case_name(num_gpus, num_procs)))
+            results[case_name(num_gpus, num_procs)] = bench_case(num_gpus, num_procs, repeat)
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, threshold=0.2, min_delta=0.05):
+    # stages whose median got slower than the baseline by more than threshold
+    # (relative) and min_delta milliseconds (so that noise on tiny stages does
+    # not count). returns a list of (case, stage, baseline ms, current ms).
+    regressions = []
+    for case, stages in report['results'].items():
+        if case not in baseline['results']:
+            continue
+        for stage, timing in stages.items():
+            if stage not in baseline['results'][case]:
+                continue
+            before = baseline['results'][case][stage]['median']
+            after = timing['median']
+            if after > before * (1 + threshold) and after - before > min_delta:
+                regressions.append((case, stage, before, after))
+    return regressions
+
+def format_report(report, baseline=None):
+    lines = []
+    for case, stages in report['results'].items():
+        lines.append(case)
+        for stage, timing in stages.items():
+            line = '    {0:<16}{1:>10.3f} ms'.format(stage, timing['median'])
+            if baseline is not None and stage in baseline['results'].get(case, {}):
+                before = baseline['results'][case][stage]['median']
+                line += '{0:>+9.1f}%'.format((timing['median'] / before - 1) * 100 if before > 0 else 0)
+            lines.append(line)
+    return '\n'.join(lines)
+
+def log_to_stderr(message):
+    sys.stderr.write(message + '\n')
+    sys.stderr.flush()
@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from gpuutil.gpuutil import GPUStat, GPUSnapshot, loadfile, describe_error, draw_table, draw_process_table, device_rows, process_lines, available_cols
+import json
+
+default_host_spec = {
+    "nvsmi_cmd": "ssh -o BatchMode=yes {host} nvidia-smi -q -x",
+    "nvsmi_watch_cmd": "ssh -o BatchMode=yes {host} nvidia-smi -q -x -lms {interval_ms}",
+    "ps_cmd": "ssh -o BatchMode=yes {host} ps -o user:20,pid,args:1024 -p {pids}",
+    "topo_cmd": "ssh -o BatchMode=yes {host} nvidia-smi topo -m",
+    "mig_list_cmd": "ssh -o BatchMode=yes {host} nvidia-smi -L",
+}
+
+def load_hosts(path):
+    # a json dict of {host: spec}, or a text file with one host per line.
+    # a spec may contain nvsmi_cmd/nvsmi_watch_cmd/ps_cmd/topo_cmd/mig_list_cmd
+    # templates ({host} is replaced by the host name, {pids} by the pids found
+    # by nvidia-smi), nvsmi_src/ps_src/topo_src/mig_list_src files,
+    # ps_name_trans and timeout.
+    content = loadfile(path).strip()
+    if content.startswith('{'):
+        return json.loads(content)
+    hosts = {}
+    for line in content.split('\n'):
+        line = line.split('#')[0].strip()
+        if line != '':
+            hosts[line] = {}
+    return hosts
+
+def host_stat(host, spec):
+    stat = GPUStat()
+    # none of the local sources, backend or cache settings apply to other
+    # hosts, every one of them comes from the spec or the ssh defaults.
+    stat.cache = None
+    stat.backend = 'xml'
+    stat.nvsmi_source = spec.get('nvsmi_src')
+    stat.ps_source = spec.get('ps_src')
+    stat.ps_name_trans = spec.get('ps_name_trans')
+    stat.gpu_csv_source = None
+    stat.apps_csv_source = None
+    stat.replay_source = None
+    stat.replay_clock = None
+    stat.topo_source = spec.get('topo_src')
+    stat.topo = None
+    # the topology file in /dev/shm is the one of this machine.
+    stat.topo_cache = False
+    stat.mig_list_source = spec.get('mig_list_src')
+    for key in ['nvsmi_cmd', 'nvsmi_watch_cmd', 'ps_cmd', 'topo_cmd', 'mig_list_cmd']:
+        setattr(stat, key, spec.get(key, default_host_spec[key]).replace('{host}', host))
+    if 'timeout' in spec:
+        stat.timeouts = {'nvsmi': spec['timeout'], 'ps': spec['timeout']}
+    return stat
+
+class ClusterStat():
+    def __init__(self, hosts, max_workers=16):
+        self.hosts = hosts
+        self.max_workers = max_workers
+        self.stats = {host: host_stat(host, spec) for host, spec in hosts.items()}
+        self.snapshots = {}
+    def parse(self):
+        # every host is bounded by its own timeouts, so no host can hold the others.
+        def collect(host):
+            try:
+                return self.stats[host].collect()
+            except Exception as e:
+                return GPUSnapshot([], partial=True, errors={'host': describe_error(e)})
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(self.hosts)))) as executor:
+            snapshots = executor.map(collect, list(self.hosts.keys()))
+            self.snapshots = dict(zip(self.hosts.keys(), snapshots))
+        return self.snapshots
+    def render(self, enabled_cols=None, colsty=None, colsz=None, show_command=True, vertical=False):
+        if enabled_cols is None:
+            enabled_cols = list(available_cols)
+        info_table = [['Host'] + enabled_cols]
+        for host, snapshot in self.snapshots.items():
+            for row in device_rows(snapshot.devices, enabled_cols, vertical):
+                info_table.append([host] + row)
+        if colsty is not None:
+            colsty = '|c' + colsty
+        if colsz is not None:
+            colsz = [None] + list(colsz)
+        info = draw_table(info_table, rowsty='|c|{0}|'.format('c'*(len(info_table)-1)), colsty=colsty, colsz=colsz) + '\n'
+        if show_command:
+            proc_strs = []
+            for host, snapshot in self.snapshots.items():
+                proc_strs += process_lines(snapshot.devices, prefix='{0}|'.format(host))
+            info += draw_process_table(proc_strs, info.find('\n'))
+        failed = ['{0}: {1}'.format(host, ', '.join('{0} {1}'.format(k, v) for k, v in snapshot.errors.items()))
+                  for host, snapshot in self.snapshots.items() if snapshot.partial]
+        if len(failed) > 0:
+            info += '\nPartial result: ' + '; '.join(failed)
+        return info
+    def show(self, **kwargs):
+        self.parse()
+        print(self.render(**kwargs))
+    def find_free_gpus(self, num, min_free_mem=None):
+        # the num freest gpus over all hosts as [(host, gpu id)], gpus without
+        # processes come first, then the ones with more free memory.
+        candidates = []
+        for host, snapshot in self.snapshots.items():
+            for gpu in snapshot.devices:
+                free_mem = gpu.mem_free or 0
+                if min_free_mem is not None and free_mem < min_free_mem:
+                    continue
+                candidates.append((len(gpu.processes) > 0, -free_mem, gpu.util or 0, host, gpu.id))
+        candidates.sort()
+        return [(host, gpu_id) for _, _, _, host, gpu_id in candidates[:num]]
@@ -0,0 +1,136 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+# (metric name, help, GPUDevice field)
+gpu_metrics = [
+    ('gpuutil_gpu_utilization_percent', 'GPU utilization.', 'util'),
+    ('gpuutil_gpu_memory_used_mib', 'Used GPU memory.', 'mem_used'),
+    ('gpuutil_gpu_memory_free_mib', 'Free GPU memory.', 'mem_free'),
+    ('gpuutil_gpu_memory_total_mib', 'Total GPU memory.', 'mem_total'),
+    ('gpuutil_gpu_temperature_celsius', 'GPU temperature.', 'temp'),
+    ('gpuutil_gpu_temperature_max_celsius', 'GPU temperature limit.', 'temp_max'),
+    ('gpuutil_gpu_power_watts', 'GPU power draw.', 'power'),
+    ('gpuutil_gpu_power_max_watts', 'GPU power limit.', 'power_max'),
+    ('gpuutil_gpu_clock_mhz', 'SM clock.', 'clock'),
+    ('gpuutil_gpu_clock_max_mhz', 'Max SM clock.', 'clock_max'),
+    ('gpuutil_gpu_fan_percent', 'Fan speed.', 'fan'),
+]
+
+prometheus_type = 'text/plain; version=0.0.4; charset=utf-8'
+openmetrics_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return '{' + ','.join('{0}="{1}"'.format(key, escape_label(value)) for key, value in values.items()) + '}'
+
+def render_metrics(snapshot):
+    # the snapshot in the prometheus text format, values that are not available are left out.
+    lines = []
+    def gauge(name, help):
+        lines.append('# HELP {0} {1}'.format(name, help))
+        lines.append('# TYPE {0} gauge'.format(name))
+    gauge('gpuutil_snapshot_timestamp_seconds', 'When the sample was taken.')
+    lines.append('gpuutil_snapshot_timestamp_seconds {0}'.format(snapshot.timestamp))
+    gauge('gpuutil_snapshot_partial', 'Whether some collector failed or timed out for this sample.')
+    lines.append('gpuutil_snapshot_partial {0}'.format(int(snapshot.partial)))
+    for name, help, field in gpu_metrics:
+        gauge(name, help)
+        for gpu in snapshot.devices:
+            value = getattr(gpu, field)
+            if value is not None:
+                lines.append('{0}{1} {2}'.format(name, labels(gpu=gpu.id, uuid=gpu.uuid, name=gpu.name), value))
+    gauge('gpuutil_gpu_processes', 'Number of processes on the GPU.')
+    for gpu in snapshot.devices:
+        lines.append('gpuutil_gpu_processes{0} {1}'.format(labels(gpu=gpu.id, uuid=gpu.uuid, name=gpu.name), len(gpu.processes)))
+    gauge('gpuutil_process_memory_used_mib', 'GPU memory used by a process.')
+    for gpu in snapshot.devices:
+        for proc in gpu.processes:
+            if proc.vmem is not None:
+                lines.append('gpuutil_process_memory_used_mib{0} {1}'.format(labels(gpu=gpu.id, pid=proc.pid, user=proc.user), proc.vmem))
+    return '\n'.join(lines) + '\n'
+
+class MetricsExporter():
+    # one background sampler (a single nvidia-smi -l stream), whose latest
+    # sample is rendered once. scrapes only return the rendered pages, so
+    # they never wait for the driver and more scrapers cost no more queries.
+    def __init__(self, stat, interval=1):
+        self.stat = stat
+        self.interval = interval
+        self.pages = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+    def publish(self, snapshot):
+        metrics = render_metrics(snapshot)
+        pages = {
+            'metrics': metrics.encode('utf-8'),
+            'openmetrics': (metrics + '# EOF\n').encode('utf-8'),
+            'snapshot': json.dumps(snapshot.to_record()).encode('utf-8'),
+        }
+        with self.lock:
+            self.pages = pages
+    def page(self, name):
+        with self.lock:
+            return None if self.pages is None else self.pages[name]
+    def run(self):
+        while not self.stopped.is_set():
+            samples = self.stat.watch(self.interval)
+            try:
+                for snapshot in samples:
+                    self.publish(snapshot)
+                    if self.stopped.is_set():
+                        break
+            except Exception:
+                # nvidia-smi failed, the last sample is served until it is back.
+                pass
+            finally:
+                samples.close()
+            self.stopped.wait(self.interval)
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+    def stop(self):
+        self.stopped.set()
+
+def make_handler(exporter):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/metrics':
+                if 'application/openmetrics-text' in self.headers.get('Accept', ''):
+                    self.reply(exporter.page('openmetrics'), openmetrics_type)
+                else:
+                    self.reply(exporter.page('metrics'), prometheus_type)
+            elif path == '/snapshot.json':
+                self.reply(exporter.page('snapshot'), 'application/json')
+            elif path == '/':
+                self.reply(b'<a href="/metrics">/metrics</a> <a href="/snapshot.json">/snapshot.json</a>\n', 'text/html')
+            else:
+                self.send_error(404)
+        def reply(self, body, content_type):
+            if body is None:
+                # nothing was sampled yet.
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+def serve(stat, port=9400, bind='0.0.0.0', interval=1):
+    exporter = MetricsExporter(stat, interval).start()
+    server = ThreadingHTTPServer((bind, port), make_handler(exporter))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        exporter.stop()
+        server.server_close()
@@ -1,14 +1,22 @@
-from io import StringIO
-from sys import platform
-import xml.etree.ElementTree as ET
+from io import StringIO, BytesIO
 import os
 import json
-import random
 import sys
-import csv
-import platform
+import time
+try:
+    import pwd
+    import fcntl
+except ImportError:
+    # not available on windows.
+    pwd = None
+    fcntl = None
 
-osname = platform.system()
+# the cli is run many times a minute from prompts and status lines, so the
+# slower modules (xml, csv, subprocess, asyncio, threads...) are only
+# imported by the functions that use them.
+
+# same as platform.system(), without importing platform.
+osname = {'win32': 'Windows', 'cygwin': 'Windows', 'linux': 'Linux', 'darwin': 'Darwin'}.get(sys.platform, sys.platform)
 
 def loadfile(path):
     with open(path, 'r', encoding='utf-8') as f:
@@ -28,9 +36,121 @@ def savedict(path, dictionary):
     content = json.dumps(dictionary, indent=4, ensure_ascii=False)
     savefile(path, content)
 
-def exe_cmd(command):
-    pipe = os.popen(command)
-    return pipe.read()
+configurations = {}
+def load_configuration(path=None):
+    # ~/.gpuutil.conf is parsed once per process, and again only if it changed.
+    if path is None:
+        path = os.path.expanduser('~/.gpuutil.conf')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if path not in configurations or configurations[path][0] != mtime:
+        configurations[path] = (mtime, loaddict(path))
+    return configurations[path][1]
+
+def exe_cmd(command, timeout=None, check=False):
+    # raises subprocess.TimeoutExpired after killing the command if it takes too long,
+    # and subprocess.CalledProcessError if check is set and the command failed.
+    import shlex
+    import subprocess
+    args = command if osname == 'Windows' else shlex.split(command)
+    result = subprocess.run(args, stdout=subprocess.PIPE, timeout=timeout, check=check)
+    return result.stdout.decode('utf-8', errors='replace')
+
+timeout_errors = [('subprocess', 'TimeoutExpired'), ('asyncio', 'TimeoutError'), ('concurrent.futures', 'TimeoutError')]
+
+def describe_error(e):
+    # a module that was never imported can not have raised its timeout.
+    for module, name in timeout_errors:
+        if module in sys.modules and isinstance(e, getattr(sys.modules[module], name)):
+            return 'timeout'
+    return '{0}: {1}'.format(type(e).__name__, e)
+
+async def exe_cmd_async(command, timeout=None):
+    # same as exe_cmd, but waits on the event loop instead of blocking it.
+    import asyncio
+    import shlex
+    import subprocess
+    proc = await asyncio.create_subprocess_exec(*shlex.split(command), stdout=subprocess.PIPE)
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    finally:
+        # timed out or cancelled by the caller.
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    return stdout.decode('utf-8', errors='replace')
+
+async def run_concurrently_async(jobs, timeouts=None):
+    # jobs: {name: coroutine function}, same as run_concurrently on the event loop.
+    import asyncio
+    if timeouts is None:
+        timeouts = {}
+    names = list(jobs.keys())
+    outputs = await asyncio.gather(*[asyncio.wait_for(jobs[name](), timeouts.get(name)) for name in names], return_exceptions=True)
+    results = {}
+    errors = {}
+    for name, output in zip(names, outputs):
+        if isinstance(output, Exception):
+            errors[name] = describe_error(output)
+        else:
+            results[name] = output
+    return results, errors
+
+def run_concurrently(jobs, timeouts=None):
+    # jobs: {name: function}, run them at the same time and wait each of them
+    # for at most timeouts[name] seconds, returns ({name: result}, {name: error}).
+    if timeouts is None:
+        timeouts = {}
+    results = {}
+    errors = {}
+    if len(jobs) == 0:
+        return results, errors
+    if len(jobs) == 1:
+        # nothing to wait for at the same time, the commands time out by themselves.
+        for name, job in jobs.items():
+            try:
+                results[name] = job()
+            except Exception as e:
+                errors[name] = describe_error(e)
+        return results, errors
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=len(jobs))
+    start = time.time()
+    futures = {name: executor.submit(job) for name, job in jobs.items()}
+    for name, future in futures.items():
+        timeout = timeouts.get(name)
+        if timeout is not None:
+            timeout = max(0, start + timeout - time.time())
+        try:
+            results[name] = future.result(timeout=timeout)
+        except Exception as e:
+            errors[name] = describe_error(e)
+    # a hung job is left behind instead of blocking the caller.
+    executor.shutdown(wait=False)
+    return results, errors
+
+class NvsmiStreamSplitter():
+    # split the output of `nvidia-smi -q -x -l` into separate xml documents.
+    def __init__(self, root_tag='nvidia_smi_log'):
+        self.end_tag = '</{0}>'.format(root_tag).encode('utf-8')
+        self.buffer = b''
+        self.search_from = 0
+    def feed(self, chunk):
+        self.buffer += chunk
+        documents = []
+        while True:
+            pos = self.buffer.find(self.end_tag, self.search_from)
+            if pos < 0:
+                # the end tag may be cut in the middle, search again from there.
+                self.search_from = max(0, len(self.buffer) - len(self.end_tag))
+                break
+            pos += len(self.end_tag)
+            documents.append(self.buffer[:pos].strip())
+            self.buffer = self.buffer[pos:]
+            self.search_from = 0
+        return documents
 
 def xml2dict(node):
     node_dict = {}
@@ -46,7 +166,89 @@ def xml2dict(node):
             node_dict[child.tag].append(xml2dict(child))
     return node_dict
 
-def parse_nvsmi_info(nvsmixml):
+# fields used by parse_gpu_info and simplify_gpu_info, a field keeps its whole subtree.
+nvsmi_default_fields = [
+    'driver_version',
+    'cuda_version',
+    'attached_gpus',
+    'gpu/product_name',
+    'gpu/uuid',
+    'gpu/pci/pci_bus_id',
+    'gpu/fan_speed',
+    'gpu/fb_memory_usage',
+    'gpu/utilization',
+    'gpu/temperature',
+    'gpu/power_readings',
+    'gpu/clocks',
+    'gpu/max_clocks',
+    'gpu/processes',
+    'gpu/mig_devices',
+]
+
+def build_projection(fields):
+    # ['gpu/pci/pci_bus_id', ...] -> {'gpu': {'pci': {'pci_bus_id': None}}}, None keeps the whole subtree.
+    projection = {}
+    for field in fields:
+        node = projection
+        parts = field.split('/')
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return projection
+
+def project_element(elem, projection):
+    if len(elem) == 0:
+        return (elem.text or '').strip()
+    node_dict = {}
+    for child in elem:
+        if child.tag not in projection:
+            continue
+        sub_projection = projection[child.tag]
+        value = xml2dict(child) if sub_projection is None else project_element(child, sub_projection)
+        if child.tag not in node_dict:
+            node_dict[child.tag] = value
+        else:
+            if type(node_dict[child.tag]) is not list:
+                node_dict[child.tag] = [node_dict[child.tag]]
+            node_dict[child.tag].append(value)
+    return node_dict
+
+def projected_xml2dict(nvsmixml, fields, record_tag='gpu'):
+    # same layout as xml2dict but only with the given fields. every <gpu> is
+    # projected and released as soon as it is parsed, so memory stays bounded
+    # by the size of a single gpu, no matter how many gpus there are.
+    if type(nvsmixml) is str:
+        nvsmixml = nvsmixml.encode('utf-8')
+    import xml.etree.ElementTree as ET
+    projection = build_projection(fields)
+    records = []
+    root = None
+    for _, elem in ET.iterparse(BytesIO(nvsmixml), events=('end',)):
+        root = elem
+        if elem.tag != record_tag:
+            continue
+        if record_tag in projection:
+            record_projection = projection[record_tag]
+            records.append(xml2dict(elem) if record_projection is None else project_element(elem, record_projection))
+        elem.clear()
+    # the root is the last element to end, only top-level fields are left in it.
+    info = project_element(root, {key: value for key, value in projection.items() if key != record_tag})
+    if type(info) is not dict:
+        info = {}
+    if len(records) == 1:
+        info[record_tag] = records[0]
+    elif len(records) > 1:
+        info[record_tag] = records
+    return info
+
+def parse_nvsmi_info(nvsmixml, fields=None):
+    # fields=None keeps the full dict of every element.
+    if fields is not None:
+        return projected_xml2dict(nvsmixml, fields)
+    import xml.etree.ElementTree as ET
     tree = ET.fromstring(nvsmixml)
     return xml2dict(tree)
 
@@ -64,6 +266,10 @@ def parse_gpu_info(stat):
     max_clocks = stat['max_clocks']
     processes = [] if 'process_info' not in stat['processes'] else stat['processes']['process_info']
     processes = processes if type(processes) is list else [processes]
+    # "None" when mig is disabled.
+    mig_devices = stat.get('mig_devices')
+    mig_devices = mig_devices.get('mig_device', []) if type(mig_devices) is dict else []
+    mig_devices = mig_devices if type(mig_devices) is list else [mig_devices]
     return {
         "name": name,
         "uuid": uuid,
@@ -75,12 +281,14 @@ def parse_gpu_info(stat):
         "power": power,
         "clocks": clocks,
         "max_clocks": max_clocks,
-        "processes": processes
+        "processes": processes,
+        "mig_devices": mig_devices
     }
 
 def simplify_gpu_info(stat):
     info = {
         "name": stat['name'],
+        "uuid": stat['uuid'],
         "memory": stat['memory'],
         "fan_speed": stat['fan_speed'],
         "utilization": stat['utilization']['gpu_util'],
@@ -100,41 +308,599 @@ def simplify_gpu_info(stat):
             {
                 "pid": p['pid'],
                 "name": p['process_name'],
-                "vmem": p['used_memory']
+                "vmem": p['used_memory'],
+                "gpu_instance_id": p.get('gpu_instance_id', 'N/A'),
+                "compute_instance_id": p.get('compute_instance_id', 'N/A')
             } for p in stat["processes"]
+        ],
+        "mig_devices": [
+            {
+                "index": m.get('index'),
+                "gpu_instance_id": m.get('gpu_instance_id'),
+                "compute_instance_id": m.get('compute_instance_id'),
+                "sm_count": m.get('device_attributes', {}).get('shared', {}).get('multiprocessor_count', 'N/A'),
+                "memory": m.get('fb_memory_usage', {})
+            } for m in stat["mig_devices"]
         ]
     }
     return info
 
+# (query field, unit of the value) used by the csv backend, units are added
+# back so that the gpus have exactly the same strings as the xml backend.
+csv_gpu_fields = [
+    ('index', None),
+    ('uuid', None),
+    ('name', None),
+    ('pci.bus_id', None),
+    ('driver_version', None),
+    ('fan.speed', '%'),
+    ('utilization.gpu', '%'),
+    ('memory.used', 'MiB'),
+    ('memory.total', 'MiB'),
+    ('memory.free', 'MiB'),
+    ('temperature.gpu', 'C'),
+    ('power.draw', 'W'),
+    ('power.default_limit', 'W'),
+    ('clocks.sm', 'MHz'),
+    ('clocks.max.sm', 'MHz'),
+]
+csv_app_fields = [
+    ('gpu_uuid', None),
+    ('pid', None),
+    ('process_name', None),
+    ('used_memory', 'MiB'),
+]
+
+def csv_query_cmd(option, fields):
+    return 'nvidia-smi --{0}={1} --format=csv,noheader,nounits'.format(option, ','.join(name for name, _ in fields))
+
+def parse_csv_table(content, fields):
+    # accepts both noheader output and recorded files with a header line.
+    # columns are taken in the order of the query, the header does not always
+    # use the query names (clocks.sm is "clocks.current.sm [MHz]").
+    names = [name for name, _ in fields]
+    units = dict(fields)
+    rows = []
+    import csv
+    reader = csv.reader(StringIO(content), skipinitialspace=True)
+    for i, row in enumerate(reader):
+        row = [col.strip() for col in row]
+        if len(row) == 0 or (len(row) == 1 and row[0] == ''):
+            continue
+        if i == 0 and row[0].split(' ')[0] == names[0]:
+            continue
+        values = {}
+        for name, value in zip(names, row):
+            if value.startswith('[') or value in ['N/A', '']:
+                # [N/A] or [Not Supported]
+                value = 'N/A'
+            elif units[name] is not None:
+                value = '{0} {1}'.format(value.split(' ')[0], units[name])
+            values[name] = value
+        rows.append(values)
+    return rows
+
+def parse_csv_info(gpu_csv, apps_csv):
+    gpus = parse_csv_table(gpu_csv, csv_gpu_fields)
+    apps = parse_csv_table(apps_csv, csv_app_fields)
+    info = {
+        "attached_gpus": str(len(gpus)),
+        "gpus": []
+    }
+    if len(gpus) > 0:
+        info["driver_version"] = gpus[0].get('driver_version', 'N/A')
+    processes = {gpu.get('uuid'): [] for gpu in gpus}
+    for app in apps:
+        if app.get('gpu_uuid') in processes:
+            processes[app['gpu_uuid']].append({
+                "pid": app.get('pid'),
+                "name": app.get('process_name', 'N/A'),
+                "vmem": app.get('used_memory', 'N/A')
+            })
+    for gpu in gpus:
+        used = gpu.get('memory.used', 'N/A')
+        info["gpus"].append({
+            "name": gpu.get('name', 'N/A'),
+            "uuid": gpu.get('uuid', 'N/A'),
+            "memory": {
+                "total": gpu.get('memory.total', 'N/A'),
+                "used": used,
+                "free": gpu.get('memory.free', 'N/A')
+            },
+            "fan_speed": gpu.get('fan.speed', 'N/A'),
+            "utilization": gpu.get('utilization.gpu', 'N/A'),
+            "temperature": {
+                "current": gpu.get('temperature.gpu', 'N/A'),
+                # no query field reports the slowdown threshold.
+                "max": 'N/A',
+            },
+            "power": {
+                "current": gpu.get('power.draw', 'N/A'),
+                "max": gpu.get('power.default_limit', 'N/A')
+            },
+            "clocks": {
+                "current": gpu.get('clocks.sm', 'N/A'),
+                "max": gpu.get('clocks.max.sm', 'N/A')
+            },
+            "processes": processes[gpu.get('uuid')]
+        })
+    return info
+
+def parse_quantity(value):
+    # '1234 MiB' -> 1234, '9.10 W' -> 9.1, 'N/A' -> None
+    if value is None:
+        return None
+    number = value.split(' ')[0].strip()
+    try:
+        return int(number)
+    except ValueError:
+        pass
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def format_quantity(value, unit=None):
+    if value is None:
+        return 'N/A'
+    if type(value) is float:
+        value = '{0:.2f}'.format(value)
+    if unit is None:
+        return str(value)
+    return '{0} {1}'.format(value, unit)
+
+def parse_instance_id(value):
+    return int(value) if value is not None and str(value).isdigit() else None
+
+class GPUProcess():
+    # gpu_instance/compute_instance tell which mig instance the process runs on, None without mig.
+    __slots__ = ['pid', 'name', 'vmem', 'user', 'uid', 'command', 'gpu_instance', 'compute_instance']
+    def __init__(self, pid, name=None, vmem=None, user=None, uid=None, command=None, gpu_instance=None, compute_instance=None):
+        self.pid = pid
+        self.name = name
+        self.vmem = vmem
+        self.user = user
+        self.uid = uid
+        self.command = command
+        self.gpu_instance = gpu_instance
+        self.compute_instance = compute_instance
+    @classmethod
+    def from_dict(cls, info):
+        return cls(
+            pid = int(info['pid']),
+            name = info.get('name'),
+            vmem = parse_quantity(info.get('vmem')),
+            user = info.get('user'),
+            uid = info.get('uid'),
+            command = info.get('command'),
+            gpu_instance = parse_instance_id(info.get('gpu_instance_id')),
+            compute_instance = parse_instance_id(info.get('compute_instance_id'))
+        )
+    def to_dict(self):
+        info = {
+            "pid": str(self.pid),
+            "name": self.name,
+            "vmem": format_quantity(self.vmem, 'MiB'),
+            "user": self.user,
+            "command": self.command
+        }
+        if self.uid is not None:
+            info["uid"] = self.uid
+        if self.gpu_instance is not None:
+            info["gpu_instance_id"] = str(self.gpu_instance)
+            info["compute_instance_id"] = str(self.compute_instance)
+        return info
+    def to_record(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+    @classmethod
+    def from_record(cls, record):
+        return cls(**record)
+
+class MIGDevice():
+    # a mig instance of a gpu. id is '{gpu id}/{index}', uuid is only known
+    # after GPUStat.mig_uuids(). processes are those of the gpu that run on it.
+    __slots__ = ['id', 'gpu', 'index', 'gpu_instance', 'compute_instance', 'uuid', 'sm_count', 'mem_used', 'mem_total', 'mem_free', 'processes']
+    def __init__(self, gpu, index, gpu_instance=None, compute_instance=None, uuid=None, sm_count=None, mem_used=None, mem_total=None, mem_free=None, processes=None):
+        self.id = '{0}/{1}'.format(gpu, index)
+        self.gpu = gpu
+        self.index = index
+        self.gpu_instance = gpu_instance
+        self.compute_instance = compute_instance
+        self.uuid = uuid
+        self.sm_count = sm_count
+        self.mem_used = mem_used
+        self.mem_total = mem_total
+        self.mem_free = mem_free
+        self.processes = [] if processes is None else processes
+    def quantity(self, field):
+        return format_quantity(getattr(self, field), GPUDevice.units.get(field))
+    def runs(self, proc):
+        return proc.gpu_instance == self.gpu_instance and proc.compute_instance == self.compute_instance
+    @classmethod
+    def from_dict(cls, gpu_id, info, processes):
+        mig = cls(
+            gpu = gpu_id,
+            index = parse_instance_id(info.get('index')),
+            gpu_instance = parse_instance_id(info.get('gpu_instance_id')),
+            compute_instance = parse_instance_id(info.get('compute_instance_id')),
+            sm_count = parse_quantity(info.get('sm_count')),
+            mem_used = parse_quantity(info['memory'].get('used')),
+            mem_total = parse_quantity(info['memory'].get('total')),
+            mem_free = parse_quantity(info['memory'].get('free'))
+        )
+        mig.processes = [proc for proc in processes if mig.runs(proc)]
+        return mig
+    def to_dict(self):
+        return {
+            "index": str(self.index),
+            "gpu_instance_id": str(self.gpu_instance),
+            "compute_instance_id": str(self.compute_instance),
+            "sm_count": format_quantity(self.sm_count),
+            "memory": {
+                "total": self.quantity('mem_total'),
+                "used": self.quantity('mem_used'),
+                "free": self.quantity('mem_free')
+            }
+        }
+    def to_record(self):
+        return {key: getattr(self, key) for key in self.__slots__ if key not in ['id', 'processes']}
+    @classmethod
+    def from_record(cls, record, processes):
+        mig = cls(**record)
+        mig.processes = [proc for proc in processes if mig.runs(proc)]
+        return mig
+
+class GPUDevice():
+    # mig: the MIGDevice of the gpu, empty if mig is disabled.
+    __slots__ = ['id', 'name', 'uuid', 'fan', 'util', 'temp', 'temp_max', 'power', 'power_max',
+                 'clock', 'clock_max', 'mem_used', 'mem_total', 'mem_free', 'processes', 'mig']
+    units = {
+        'fan': '%',
+        'util': '%',
+        'temp': 'C',
+        'temp_max': 'C',
+        'power': 'W',
+        'power_max': 'W',
+        'clock': 'MHz',
+        'clock_max': 'MHz',
+        'mem_used': 'MiB',
+        'mem_total': 'MiB',
+        'mem_free': 'MiB',
+    }
+    def __init__(self, id, name=None, uuid=None, processes=None, mig=None, **values):
+        self.id = id
+        self.name = name
+        self.uuid = uuid
+        self.processes = [] if processes is None else processes
+        self.mig = [] if mig is None else mig
+        for field in self.units:
+            setattr(self, field, values.get(field))
+    def quantity(self, field):
+        # '45 C', or 'N/A' if the value is not available.
+        return format_quantity(getattr(self, field), self.units[field])
+    @classmethod
+    def from_dict(cls, info):
+        processes = [GPUProcess.from_dict(p) for p in info['processes']]
+        return cls(
+            id = info.get('id'),
+            name = info.get('name'),
+            uuid = info.get('uuid'),
+            fan = parse_quantity(info['fan_speed']),
+            util = parse_quantity(info['utilization']),
+            temp = parse_quantity(info['temperature']['current']),
+            temp_max = parse_quantity(info['temperature']['max']),
+            power = parse_quantity(info['power']['current']),
+            power_max = parse_quantity(info['power']['max']),
+            clock = parse_quantity(info['clocks']['current']),
+            clock_max = parse_quantity(info['clocks']['max']),
+            mem_used = parse_quantity(info['memory']['used']),
+            mem_total = parse_quantity(info['memory']['total']),
+            mem_free = parse_quantity(info['memory']['free']),
+            processes = processes,
+            mig = [MIGDevice.from_dict(info.get('id'), m, processes) for m in info.get('mig_devices', [])]
+        )
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "uuid": self.uuid,
+            "memory": {
+                "total": self.quantity('mem_total'),
+                "used": self.quantity('mem_used'),
+                "free": self.quantity('mem_free')
+            },
+            "fan_speed": self.quantity('fan'),
+            "utilization": self.quantity('util'),
+            "temperature": {
+                "current": self.quantity('temp'),
+                "max": self.quantity('temp_max')
+            },
+            "power": {
+                "current": self.quantity('power'),
+                "max": self.quantity('power_max')
+            },
+            "clocks": {
+                "current": self.quantity('clock'),
+                "max": self.quantity('clock_max')
+            },
+            "processes": [p.to_dict() for p in self.processes],
+            "mig_devices": [m.to_dict() for m in self.mig]
+        }
+    def to_record(self):
+        record = {key: getattr(self, key) for key in self.__slots__}
+        record['processes'] = [p.to_record() for p in self.processes]
+        record['mig'] = [m.to_record() for m in self.mig]
+        return record
+    @classmethod
+    def from_record(cls, record):
+        record = dict(record)
+        record['processes'] = [GPUProcess.from_record(p) for p in record['processes']]
+        record['mig'] = [MIGDevice.from_record(m, record['processes']) for m in record.get('mig', [])]
+        return cls(**record)
+
+class GPUSnapshot():
+    # one sample of all gpus, numbers are parsed once when it is built.
+    # partial is set when some collector failed or timed out, errors tells which one and why.
+    __slots__ = ['timestamp', 'driver_version', 'cuda_version', 'attached_gpus', 'devices', 'partial', 'errors']
+    def __init__(self, devices, timestamp=None, driver_version='', cuda_version='', attached_gpus='', partial=False, errors=None):
+        self.devices = devices
+        self.partial = partial
+        self.errors = {} if errors is None else errors
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.driver_version = driver_version
+        self.cuda_version = cuda_version
+        self.attached_gpus = attached_gpus
+    def to_dicts(self):
+        return [device.to_dict() for device in self.devices]
+    def to_record(self):
+        # a json friendly dict that keeps the parsed values.
+        record = {key: getattr(self, key) for key in self.__slots__}
+        record['devices'] = [device.to_record() for device in self.devices]
+        return record
+    @classmethod
+    def from_record(cls, record):
+        record = dict(record)
+        record['devices'] = [GPUDevice.from_record(device) for device in record['devices']]
+        return cls(**record)
+
+class SnapshotDiff():
+    # what changed from one snapshot to the next. gpus are matched by id and
+    # processes by gpu id and pid.
+    # added/removed: gpu ids. started/exited: [(gpu id, GPUProcess)].
+    # changed: {gpu id: {field: (old, new)}}, changed_processes: {(gpu id, pid): {field: (old, new)}}.
+    __slots__ = ['timestamp', 'added', 'removed', 'started', 'exited', 'changed', 'changed_processes']
+    gpu_fields = ['name', 'uuid'] + list(GPUDevice.units)
+    process_fields = ['name', 'vmem', 'user', 'uid', 'command']
+    def __init__(self, timestamp, added=None, removed=None, started=None, exited=None, changed=None, changed_processes=None):
+        self.timestamp = timestamp
+        self.added = [] if added is None else added
+        self.removed = [] if removed is None else removed
+        self.started = [] if started is None else started
+        self.exited = [] if exited is None else exited
+        self.changed = {} if changed is None else changed
+        self.changed_processes = {} if changed_processes is None else changed_processes
+    def __bool__(self):
+        return any([self.added, self.removed, self.started, self.exited, self.changed, self.changed_processes])
+    def events(self, fields=None):
+        # one dict per change, for logs. gpu field changes are only listed for fields (all if None).
+        events = [{'event': 'added', 'gpu': gpu_id} for gpu_id in self.added]
+        events += [{'event': 'removed', 'gpu': gpu_id} for gpu_id in self.removed]
+        for name, processes in [('started', self.started), ('exited', self.exited)]:
+            for gpu_id, proc in processes:
+                event = {'event': name, 'gpu': gpu_id}
+                event.update(proc.to_record())
+                events.append(event)
+        for gpu_id, changes in self.changed.items():
+            for field, (old, new) in changes.items():
+                if fields is None or field in fields:
+                    events.append({'event': 'changed', 'gpu': gpu_id, 'field': field, 'old': old, 'new': new})
+        for (gpu_id, pid), changes in self.changed_processes.items():
+            for field, (old, new) in changes.items():
+                if fields is None or field in fields:
+                    events.append({'event': 'changed', 'gpu': gpu_id, 'pid': pid, 'field': field, 'old': old, 'new': new})
+        for event in events:
+            event['timestamp'] = self.timestamp
+        return events
+
+def changed_fields(old, new, fields):
+    changes = {}
+    for field in fields:
+        before = getattr(old, field)
+        after = getattr(new, field)
+        if before != after:
+            changes[field] = (before, after)
+    return changes
+
+def diff_snapshots(old, new):
+    diff = SnapshotDiff(new.timestamp)
+    old_gpus = {gpu.id: gpu for gpu in old.devices}
+    new_gpus = {gpu.id: gpu for gpu in new.devices}
+    diff.added = [gpu_id for gpu_id in new_gpus if gpu_id not in old_gpus]
+    diff.removed = [gpu_id for gpu_id in old_gpus if gpu_id not in new_gpus]
+    for gpu_id, gpu in new_gpus.items():
+        old_gpu = old_gpus.get(gpu_id)
+        old_processes = {} if old_gpu is None else {proc.pid: proc for proc in old_gpu.processes}
+        if old_gpu is not None:
+            changes = changed_fields(old_gpu, gpu, SnapshotDiff.gpu_fields)
+            if len(changes) > 0:
+                diff.changed[gpu_id] = changes
+        for proc in gpu.processes:
+            old_proc = old_processes.pop(proc.pid, None)
+            if old_proc is None:
+                diff.started.append((gpu_id, proc))
+                continue
+            changes = changed_fields(old_proc, proc, SnapshotDiff.process_fields)
+            if len(changes) > 0:
+                diff.changed_processes[(gpu_id, proc.pid)] = changes
+        diff.exited += [(gpu_id, proc) for proc in old_processes.values()]
+    for gpu_id in diff.removed:
+        diff.exited += [(gpu_id, proc) for proc in old_gpus[gpu_id].processes]
+    return diff
+
+def shared_dir():
+    # where the files shared by all processes and users of the node go.
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    import tempfile
+    return tempfile.gettempdir()
+
+def ensure_shared_dir(directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            # no sticky bit: anyone must be able to replace or remove the files of others.
+            os.chmod(directory, 0o777)
+        except OSError:
+            pass
+
+def share_file(path, mode=0o666):
+    # only the owner can change the mode, the first one to create it does.
+    try:
+        os.chmod(path, mode)
+    except OSError:
+        pass
+
+def default_cache_path():
+    # one cache for the node, so jobs of different users share the query too.
+    return os.path.join(shared_dir(), 'gpuutil-cache', 'snapshot.json')
+
+class SnapshotCache():
+    # a snapshot file shared by all processes on the node. a reader uses it
+    # while it is younger than ttl, otherwise exactly one process refreshes it
+    # and the others wait for that refresh instead of querying the driver too.
+    def __init__(self, path=None, ttl=1.0):
+        self.path = default_cache_path() if path is None else path
+        self.lock_path = self.path + '.lock'
+        self.stats_path = self.path + '.stats'
+        self.ttl = ttl
+        # counted in the process, and added to the stats file on refresh, on
+        # exit and at most every stats_interval seconds.
+        self.counts = {}
+        self.saved_at_exit = False
+        self.stats_interval = 10
+        self.stats_saved = time.time()
+    def read(self):
+        try:
+            return GPUSnapshot.from_record(json.loads(loadfile(self.path)))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    def write(self, snapshot):
+        # write to a temp file and rename it, so readers never see half of it.
+        temp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        savefile(temp_path, json.dumps(snapshot.to_record()))
+        share_file(temp_path, 0o644)
+        os.replace(temp_path, self.path)
+    def is_fresh(self, snapshot):
+        return snapshot is not None and time.time() - snapshot.timestamp < self.ttl
+    def get(self, refresh):
+        # refresh is called without arguments and returns a new GPUSnapshot.
+        if fcntl is None:
+            return refresh()
+        snapshot = self.read()
+        if self.is_fresh(snapshot):
+            self.count('hits')
+            if time.time() - self.stats_saved >= self.stats_interval:
+                self.save_stats()
+            return snapshot
+        self.count('misses')
+        ensure_shared_dir(os.path.dirname(os.path.abspath(self.path)))
+        with open(self.lock_path, 'a') as lock:
+            share_file(self.lock_path)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.count('waits')
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another process may have refreshed it while we were waiting.
+                snapshot = self.read()
+                if self.is_fresh(snapshot):
+                    return snapshot
+                snapshot = refresh()
+                self.count('refreshes')
+                self.write(snapshot)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        # hits cost no disk write, the counts are saved with the refreshes.
+        self.save_stats()
+        return snapshot
+    def count(self, event):
+        if not self.saved_at_exit:
+            import atexit
+            atexit.register(self.save_stats)
+            self.saved_at_exit = True
+        self.counts[event] = self.counts.get(event, 0) + 1
+    def save_stats(self):
+        # adds the counts of this process to the stats file.
+        self.stats_saved = time.time()
+        if fcntl is None or len(self.counts) == 0:
+            return
+        counts = self.counts
+        self.counts = {}
+        try:
+            with open(self.stats_path, 'a+') as f:
+                share_file(self.stats_path)
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                content = f.read().strip()
+                stats = json.loads(content) if len(content) > 0 else {}
+                for event, value in counts.items():
+                    stats[event] = stats.get(event, 0) + value
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(stats))
+        except (OSError, ValueError):
+            # the stats are only informative.
+            pass
+    def load_stats(self):
+        stats = {'hits': 0, 'misses': 0, 'waits': 0, 'refreshes': 0}
+        if os.path.isfile(self.stats_path):
+            stats.update(loaddict(self.stats_path))
+        for event, value in self.counts.items():
+            stats[event] = stats.get(event, 0) + value
+        return stats
+
+def parse_mig_list(text):
+    # nvidia-smi -L -> {(gpu uuid, mig device index): mig uuid}
+    #   GPU 0: NVIDIA A100-SXM4-40GB (UUID: GPU-5d5ba0d6-...)
+    #     MIG 3g.20gb     Device  0: (UUID: MIG-c6d4f1ef-...)
+    import re
+    uuids = {}
+    gpu_uuid = None
+    for line in text.splitlines():
+        found = re.search(r'\(UUID: ([^)]+)\)', line)
+        if found is None:
+            continue
+        if line.startswith('GPU'):
+            gpu_uuid = found.group(1)
+        else:
+            device = re.search(r'Device\s+(\d+)', line)
+            if device is not None and gpu_uuid is not None:
+                uuids[(gpu_uuid, int(device.group(1)))] = found.group(1)
+    return uuids
+
 def short_gpu_info(stat, disp_type='brief'):
+    if type(stat) is dict:
+        stat = GPUDevice.from_dict(stat)
     stat_disp = {
-        "id": stat['id'],
-        "fan": stat['fan_speed'].split(' ')[0].strip(),
-        "temp": '{cur}/{max} C'.format(
-            cur = stat['temperature']['current'].split(' ')[0].strip(),
-            max = stat['temperature']['max'].split(' ')[0].strip()
-        ),
-        "power": '{cur}/{max} W'.format(
-            cur = stat['power']['current'].split(' ')[0].strip(),
-            max = stat['power']['max'].split(' ')[0].strip()
-        ),
-        "clock": '{cur}/{max} MHz'.format(
-            cur = stat['clocks']['current'].split(' ')[0].strip(),
-            max = stat['clocks']['max'].split(' ')[0].strip()
-        ),
-        "util": stat['utilization'],
+        "id": stat.id,
+        "fan": format_quantity(stat.fan),
+        "temp": '{cur}/{max} C'.format(cur = format_quantity(stat.temp), max = format_quantity(stat.temp_max)),
+        "power": '{cur}/{max} W'.format(cur = format_quantity(stat.power), max = format_quantity(stat.power_max)),
+        "clock": '{cur}/{max} MHz'.format(cur = format_quantity(stat.clock), max = format_quantity(stat.clock_max)),
+        "util": stat.quantity('util'),
         "mem": '{cur}/{max} MiB({free}MiB free)'.format(
-            cur = stat['memory']['used'].split(' ')[0].strip(),
-            max = stat['memory']['total'].split(' ')[0].strip(),
-            free = stat['memory']['free'].split(' ')[0].strip(),
+            cur = format_quantity(stat.mem_used),
+            max = format_quantity(stat.mem_total),
+            free = format_quantity(stat.mem_free)
         )
     }
     process_fmt = '{user}({vmem}MiB,pid={pid})'
     process_info = ','.join([process_fmt.format(
-        user = proc['user'],
-        vmem = proc['vmem'].split(' ')[0].strip(),
-        pid = proc['pid']
-    ) for proc in stat['processes']])
+        user = proc.user,
+        vmem = format_quantity(proc.vmem),
+        pid = proc.pid
+    ) for proc in stat.processes])
     info = ''
     if disp_type == 'detail':
         fmt = '[{id}] F:{fan}|T:{temp}|P:{power}|C:{clock}|U:{util}|M:{mem}'
@@ -153,9 +919,13 @@ def short_gpu_info(stat, disp_type='brief'):
     return info
 
 
-def get_basic_process_info_linux():
-    pipe = os.popen('ps axo user:20,pid,args:1024')
-    output = pipe.read()
+ps_cmd_linux = 'ps axo user:20,pid,args:1024'
+tasklist_cmd_windows = 'tasklist /FO CSV'
+
+def get_basic_process_info_linux(timeout=None):
+    return parse_ps_output(exe_cmd(ps_cmd_linux, timeout))
+
+def parse_ps_output(output):
     lines = output.split('\n')[1:]
     processes = {}
     for line in lines:
@@ -171,9 +941,51 @@ def get_basic_process_info_linux():
         }
     return processes
 
-def get_basic_process_info_windows():
-    pipe = os.popen("tasklist /FO CSV")
-    content = StringIO(pipe.read())
+uid_names = {}
+def uid2name(uid):
+    if uid not in uid_names:
+        try:
+            uid_names[uid] = pwd.getpwuid(uid).pw_name
+        except (KeyError, AttributeError):
+            uid_names[uid] = str(uid)
+    return uid_names[uid]
+
+def get_process_info_by_pids_linux(pids):
+    # only look at the given pids instead of every process on the machine.
+    processes = {}
+    for pid in pids:
+        try:
+            status = loadfile(os.path.join('/proc', pid, 'status'))
+            with open(os.path.join('/proc', pid, 'cmdline'), 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            # the process has already exited.
+            continue
+        uid = None
+        name = ''
+        for line in status.split('\n'):
+            if line.startswith('Name:'):
+                name = line[5:].strip()
+            elif line.startswith('Uid:'):
+                uid = int(line.split()[1])
+                break
+        command = cmdline.replace(b'\0', b' ').decode('utf-8', errors='replace').strip()
+        if command == '':
+            # zombies and kernel threads have no cmdline.
+            command = '[{0}]'.format(name)
+        processes[pid] = {
+            "user": uid2name(uid),
+            "uid": uid,
+            "command": command
+        }
+    return processes
+
+def get_basic_process_info_windows(timeout=None):
+    return parse_tasklist_output(exe_cmd(tasklist_cmd_windows, timeout))
+
+def parse_tasklist_output(output):
+    import csv
+    content = StringIO(output)
     reader = csv.reader(content, delimiter=',', quotechar='"')
     content = []
     for row in reader:
@@ -209,10 +1021,13 @@ def get_basic_process_info_by_file(filepath, col_name_trans=None):
             interested[word] = i
     processes = {}
     for line in lines[1:]:
-        words = line.split(' ')
+        # the command may contain spaces, so keep everything after its column.
+        words = line.split(None, interested['command'])
+        if len(words) <= interested['command']:
+            continue
         pid = words[interested['pid']]
         user = words[interested['user']]
-        cmd = ' '.join(words[interested['command']:])
+        cmd = words[interested['command']].strip()
         processes[pid] = {
             "user": user,
             "command": cmd
@@ -220,16 +1035,29 @@ def get_basic_process_info_by_file(filepath, col_name_trans=None):
     return processes
 
 
-def draw_table(table, rowsty=None, colsty=None, colsz = None):
-    def justify(s, align, width):
-        if align == 'c':
-            s = s.center(width)
-        elif align == 'r':
-            s = s.rjust(width)
-        elif align == 'l':
-            s = s.ljust(width)
-        return s
+def justify(s, align, width):
+    if align == 'c':
+        s = s.center(width)
+    elif align == 'r':
+        s = s.rjust(width)
+    elif align == 'l':
+        s = s.ljust(width)
+    return s
+
+def cell_width(col):
+    return max([len(c) for c in str(col).split('\n')])
 
+def wrap_cell(word, align, width):
+    # the lines of a cell, cut to the column width and aligned.
+    cols = []
+    lines = word.split('\n')
+    for line in lines:
+        while len(line) > 0:
+            cols.append(line[:width])
+            line = line[width:]
+    return [justify(col, align, width) for col in cols]
+
+def draw_table(table, rowsty=None, colsty=None, colsz = None):
     num_cols = len(table[0])
     if rowsty is None:
         rowsty = '|' + '|'.join(['c']*len(table)) + '|'
@@ -246,8 +1074,7 @@ def draw_table(table, rowsty=None, colsty=None, colsz = None):
     # collect widths.
     for row in table:
         for i, col in enumerate(row):
-            col = str(col)
-            width = max([len(c) for c in col.split('\n')])
+            width = cell_width(col)
             if colsz[i] is not None and colsz[i] < width:
                 width = colsz[i]
             if width > col_width[i]:
@@ -282,13 +1109,7 @@ def draw_table(table, rowsty=None, colsty=None, colsz = None):
         new_row = []
         max_cols = 1
         for word, align, width in zip(row, colaligns, col_width):
-            cols = []
-            lines = word.split('\n')
-            for line in lines:
-                while len(line) > 0:
-                    cols.append(line[:width])
-                    line = line[width:]
-            cols = [justify(col, align, width) for col in cols]
+            cols = wrap_cell(word, align, width)
             if len(cols) > max_cols:
                 max_cols = len(cols)
             new_row.append(cols)
@@ -309,9 +1130,262 @@ def draw_table(table, rowsty=None, colsty=None, colsz = None):
             strings.append(content_delemeter.join(cols_to_drawn))
     return '\n'.join(strings)
 
+unknown_process = {
+    "user": "N/A",
+    "command": "N/A"
+}
+
+def source_job(command, source, timeout):
+    # read the redirected file if there is one, otherwise run the command.
+    if source is not None:
+        return lambda: loadfile(source)
+    return lambda: exe_cmd(command, timeout)
+
+def process_info_job(stat):
+    # the /proc lookup needs the pids from nvidia-smi, other sources can run at the same time.
+    # in incremental mode, only new pids are looked up after nvidia-smi.
+    if stat.resolves_by_pid() or stat.incremental:
+        return {}
+    return {'ps': stat.get_process_info}
+
+def collect_xml_info(stat):
+    jobs = {'nvsmi': source_job(stat.nvsmi_cmd, stat.nvsmi_source, stat.timeouts.get('nvsmi'))}
+    jobs.update(process_info_job(stat))
+    results, errors = run_concurrently(jobs, stat.timeouts)
+    if 'nvsmi' in errors:
+        stat.update_failed(errors)
+        return
+    stat.update(results['nvsmi'], results.get('ps'), errors)
+
+def source_job_async(command, source, timeout):
+    async def job():
+        if source is not None:
+            # redirected sources are small regular files, reading them does not block for long.
+            return loadfile(source)
+        return await exe_cmd_async(command, timeout)
+    return job
+
+def process_info_job_async(stat):
+    if stat.resolves_by_pid() or stat.incremental:
+        return {}
+    return {'ps': stat.get_process_info_async}
+
+async def collect_xml_info_async(stat):
+    jobs = {'nvsmi': source_job_async(stat.nvsmi_cmd, stat.nvsmi_source, stat.timeouts.get('nvsmi'))}
+    jobs.update(process_info_job_async(stat))
+    results, errors = await run_concurrently_async(jobs, stat.timeouts)
+    if 'nvsmi' in errors:
+        stat.update_failed(errors)
+        return
+    stat.load_xml(results['nvsmi'])
+    await stat.update_gpus_async(results.get('ps'), errors)
+
+async def collect_csv_info_async(stat):
+    timeout = stat.timeouts.get('nvsmi')
+    jobs = {
+        'nvsmi': source_job_async(csv_query_cmd('query-gpu', csv_gpu_fields), stat.gpu_csv_source, timeout),
+        'apps': source_job_async(csv_query_cmd('query-compute-apps', csv_app_fields), stat.apps_csv_source, timeout)
+    }
+    jobs.update(process_info_job_async(stat))
+    results, errors = await run_concurrently_async(jobs, dict(stat.timeouts, apps=timeout))
+    if 'nvsmi' in errors or 'apps' in errors:
+        stat.update_failed(errors)
+        return
+    stat.load_csv(results['nvsmi'], results['apps'])
+    await stat.update_gpus_async(results.get('ps'), errors)
+
+def collect_csv_info(stat):
+    timeout = stat.timeouts.get('nvsmi')
+    jobs = {
+        'nvsmi': source_job(csv_query_cmd('query-gpu', csv_gpu_fields), stat.gpu_csv_source, timeout),
+        'apps': source_job(csv_query_cmd('query-compute-apps', csv_app_fields), stat.apps_csv_source, timeout)
+    }
+    jobs.update(process_info_job(stat))
+    results, errors = run_concurrently(jobs, dict(stat.timeouts, apps=timeout))
+    if 'nvsmi' in errors or 'apps' in errors:
+        stat.update_failed(errors)
+        return
+    stat.update_csv(results['nvsmi'], results['apps'], results.get('ps'), errors)
+
+def users_column(processes, vertical=False):
+    process_fmt = '{user}({pids})'
+    users_process = {}
+    for proc in processes:
+        if proc.user not in users_process:
+            users_process[proc.user] = []
+        users_process[proc.user].append(str(proc.pid))
+    delemeter = ','
+    if vertical:
+        delemeter = '\n'
+    return delemeter.join(process_fmt.format(user=user, pids = '|'.join(users_process[user])) for user in users_process)
+
+def vmem_column(device, vertical=False):
+    return '{0}/{1} MiB'.format(format_quantity(device.mem_used), format_quantity(device.mem_total))
+
+def quantity_column(field):
+    return lambda device, vertical=False: device.quantity(field)
+
+# column -> function(gpu, vertical) that formats its cell, only the enabled
+# columns are computed.
+gpu_formatters = {
+    'ID': lambda gpu, vertical=False: str(gpu.id),
+    'Fan': quantity_column('fan'),
+    'Temp': quantity_column('temp'),
+    'TempMax': quantity_column('temp_max'),
+    'Pwr': quantity_column('power'),
+    'PwrMax': quantity_column('power_max'),
+    'Freq': quantity_column('clock'),
+    'FreqMax': quantity_column('clock_max'),
+    'Util': quantity_column('util'),
+    'Vmem': vmem_column,
+    'UsedMem': quantity_column('mem_used'),
+    'TotalMem': quantity_column('mem_total'),
+    'FreeMem': quantity_column('mem_free'),
+    'Users': lambda gpu, vertical=False: users_column(gpu.processes, vertical)
+}
+
+def empty_column(device, vertical=False):
+    return ''
+
+# the row of a mig instance under its gpu, the gpu wide columns are left empty.
+mig_formatters = {
+    'ID': lambda mig, vertical=False: mig.id,
+    'Vmem': vmem_column,
+    'UsedMem': quantity_column('mem_used'),
+    'TotalMem': quantity_column('mem_total'),
+    'FreeMem': quantity_column('mem_free'),
+    'Users': lambda mig, vertical=False: users_column(mig.processes, vertical)
+}
+
+def gpu_columns(gpu, vertical=False):
+    # all the columns of a row in the table, as strings.
+    return {key: gpu_formatters[key](gpu, vertical) for key in available_cols}
+
+def mig_columns(mig, vertical=False):
+    return {key: mig_formatters.get(key, empty_column)(mig, vertical) for key in available_cols}
+
+def device_formatters(enabled_cols):
+    # the formatters of the enabled columns, for gpus and for mig instances.
+    return [gpu_formatters[key] for key in enabled_cols], [mig_formatters.get(key, empty_column) for key in enabled_cols]
+
+def device_rows(devices, enabled_cols, vertical=False, formatters=None):
+    # the rows of the table, a gpu with mig enabled is followed by a row per instance.
+    gpu_cells, mig_cells = device_formatters(enabled_cols) if formatters is None else formatters
+    rows = []
+    for gpu in devices:
+        rows.append([cell(gpu, vertical) for cell in gpu_cells])
+        for mig in gpu.mig:
+            rows.append([cell(mig, vertical) for cell in mig_cells])
+    return rows
+
+def gpu_values(gpu):
+    # the same columns as gpu_columns, but as numbers in the units of
+    # GPUDevice.units (None if not available), for machine readable output.
+    # Vmem is the used memory, Users maps each user to its pids.
+    users = {}
+    for proc in gpu.processes:
+        if proc.user not in users:
+            users[proc.user] = []
+        users[proc.user].append(int(proc.pid) if str(proc.pid).isdigit() else proc.pid)
+    return {
+        'ID': gpu.id,
+        'Fan': gpu.fan,
+        'Temp': gpu.temp,
+        'TempMax': gpu.temp_max,
+        'Pwr': gpu.power,
+        'PwrMax': gpu.power_max,
+        'Freq': gpu.clock,
+        'FreqMax': gpu.clock_max,
+        'Util': gpu.util,
+        'Vmem': gpu.mem_used,
+        'UsedMem': gpu.mem_used,
+        'TotalMem': gpu.mem_total,
+        'FreeMem': gpu.mem_free,
+        'Users': users
+    }
+
+class RecordWriter():
+    # writes snapshots to out as they come: json (a document per sample),
+    # ndjson (a line per gpu per sample) or csv (a row per gpu per sample,
+    # after a single header).
+    formats = ['json', 'ndjson', 'csv']
+    def __init__(self, fmt, enabled_cols=None, out=None):
+        if fmt not in self.formats:
+            raise ValueError('Unknown format {0}, avaliable: {1}'.format(fmt, ','.join(self.formats)))
+        self.fmt = fmt
+        self.enabled_cols = list(available_cols) if enabled_cols is None else enabled_cols
+        self.out = sys.stdout if out is None else out
+        self.csv_writer = None
+    def records(self, snapshot, timestamp=True):
+        for gpu in snapshot.devices:
+            values = gpu_values(gpu)
+            record = {'timestamp': snapshot.timestamp} if timestamp else {}
+            for col in self.enabled_cols:
+                record[col] = values[col]
+            yield record
+    def write(self, snapshot):
+        if self.fmt == 'json':
+            self.out.write(json.dumps({'timestamp': snapshot.timestamp, 'partial': snapshot.partial, 'gpus': list(self.records(snapshot, timestamp=False))}) + '\n')
+        elif self.fmt == 'ndjson':
+            for record in self.records(snapshot):
+                self.out.write(json.dumps(record) + '\n')
+        elif self.fmt == 'csv':
+            if self.csv_writer is None:
+                import csv
+                self.csv_writer = csv.writer(self.out, lineterminator='\n')
+                self.csv_writer.writerow(['timestamp'] + self.enabled_cols)
+            for record in self.records(snapshot):
+                if 'Users' in record:
+                    record['Users'] = ','.join('{0}({1})'.format(user, '|'.join(str(pid) for pid in pids)) for user, pids in record['Users'].items())
+                self.csv_writer.writerow(['' if value is None else value for value in record.values()])
+        self.out.flush()
+
+def process_lines(devices, prefix=''):
+    # one line per process, a process using several gpus is only shown once.
+    procs = {}
+    for gpu in devices:
+        for proc in gpu.processes:
+            if proc.pid not in procs:
+                procs[proc.pid] = {'proc': proc, 'gpus': [], 'vmem': 0}
+            # processes on a mig instance show the instance.
+            instances = [mig.id for mig in gpu.mig if mig.runs(proc)]
+            procs[proc.pid]['gpus'].append(instances[0] if len(instances) > 0 else str(gpu.id))
+            if proc.vmem is not None:
+                procs[proc.pid]['vmem'] += proc.vmem
+    proc_fmt = '[{prefix}{pid}|{gpus}] {user}({vmem} MiB) {cmd}'
+    proc_strs = []
+    for pid in procs:
+        proc_strs.append(proc_fmt.format(
+            prefix = prefix,
+            user = procs[pid]['proc'].user,
+            vmem = procs[pid]['vmem'],
+            pid = str(pid).rjust(5),
+            cmd = procs[pid]['proc'].command,
+            gpus = ','.join(procs[pid]['gpus'])
+        ))
+    return proc_strs
+
+def draw_process_table(proc_strs, table_width):
+    proc_info = '\n'.join(proc_strs)
+    return draw_table([['Process Info'.center(table_width-4)], [proc_info]], rowsty="c|c|", colsty="|l|", colsz=[table_width-4])
+
+available_cols = ['ID', 'Fan', 'Temp', 'TempMax', 'Pwr', 'PwrMax', 'Freq', 'FreqMax', 'Util', 'Vmem', 'UsedMem', 'TotalMem', 'FreeMem', 'Users']
+
 class GPUStat():
-    def __init__(self):
-        self.gpus = []
+    # self.snapshot holds the parsed sample, self.gpus is the same data as plain dicts.
+    # backend name -> function that collects and fills the stat, set "backend" in ~/.gpuutil.conf to choose.
+    collectors = {
+        'xml': collect_xml_info,
+        'csv': collect_csv_info,
+    }
+    async_collectors = {
+        'xml': collect_xml_info_async,
+        'csv': collect_csv_info_async,
+    }
+
+    def __init__(self, full_info=False, incremental=False):
+        self.snapshot = None
+        self.gpu_dicts = None
         self.raw_info = None
         self.detailed_info = None
         self.process_info = None
@@ -322,11 +1396,63 @@ class GPUStat():
         self.nvsmi_source = None
         self.ps_source = None
         self.ps_name_trans = None
+        self.gpu_csv_source = None
+        self.apps_csv_source = None
+        self.topo_source = None
+        self.topo = None
+        # keep the output of topo_cmd in /dev/shm, see topology().
+        self.topo_cache = True
+        # a recording of python -m gpuutil record, played instead of nvidia-smi.
+        self.replay_source = None
+        self.replay_speed = 1
+        self.replay_clock = None
+        self.backend = 'xml'
+        self.cache = None
+        self.full_info = full_info
+        # incremental: keep the user and command of the processes between
+        # samples, only look up the new pids, and set diff to a SnapshotDiff
+        # from the previous sample (None for the first one and failed ones).
+        self.incremental = incremental
+        self.known_processes = {}
+        self.previous = None
+        self.diff = None
+        # seconds to wait for each collector before giving a partial snapshot.
+        self.timeouts = {'nvsmi': 30, 'ps': 10}
+        self.queue_dir = None
+        self.lease_dir = None
+        self.lease_ttl = 60
+        self.accounting_dir = None
+        # the "alerts" section, see gpuutil/alerts.py.
+        self.alerts = {}
+        self.nvsmi_cmd = 'nvidia-smi -q -x'
+        self.nvsmi_watch_cmd = 'nvidia-smi -q -x -lms {interval_ms}'
+        self.topo_cmd = 'nvidia-smi topo -m'
+        self.mig_list_cmd = 'nvidia-smi -L'
+        self.mig_list_source = None
+        # a ps-like command to run instead of looking at local processes,
+        # {pids} is replaced by the comma separated pids found by nvidia-smi.
+        self.ps_cmd = None
+        # raw_info only holds the fields gpuutil uses unless full_info is set.
+        self.nvsmi_fields = None if full_info else list(nvsmi_default_fields)
         self.load_configure()
     def load_configure(self):
-        configuration_path = os.path.expanduser('~/.gpuutil.conf')
-        if os.path.isfile(configuration_path):
-            configuration = loaddict(configuration_path)
+        configuration = load_configuration()
+        if len(configuration) > 0:
+            if 'backend' in configuration:
+                self.backend = configuration['backend']
+            if 'queue' in configuration:
+                self.queue_dir = configuration['queue'].get('dir')
+            if 'accounting' in configuration:
+                self.accounting_dir = configuration['accounting'].get('dir')
+            if 'alerts' in configuration:
+                self.alerts = configuration['alerts']
+            if 'lease' in configuration:
+                self.lease_dir = configuration['lease'].get('dir')
+                self.lease_ttl = configuration['lease'].get('ttl', 60)
+            if 'timeout' in configuration:
+                self.timeouts.update(configuration['timeout'])
+            if 'cache' in configuration:
+                self.cache = SnapshotCache(configuration['cache'].get('path'), configuration['cache'].get('ttl', 1.0))
             if 'redirect' in configuration:
                 if 'nvsmi_src' in configuration['redirect']:
                     self.nvsmi_source = configuration['redirect']['nvsmi_src']
@@ -334,20 +1460,135 @@ class GPUStat():
                     self.ps_source = configuration['redirect']['ps_src']
                 if 'ps_name_trans' in configuration['redirect']:
                     self.ps_name_trans = configuration['redirect']['ps_name_trans']
+                if configuration['redirect'].get('nvsmi_watch_cmd') is not None:
+                    self.nvsmi_watch_cmd = configuration['redirect']['nvsmi_watch_cmd']
+                if 'gpu_csv_src' in configuration['redirect']:
+                    self.gpu_csv_source = configuration['redirect']['gpu_csv_src']
+                if 'apps_csv_src' in configuration['redirect']:
+                    self.apps_csv_source = configuration['redirect']['apps_csv_src']
+                if 'topo_src' in configuration['redirect']:
+                    self.topo_source = configuration['redirect']['topo_src']
+                if 'mig_list_src' in configuration['redirect']:
+                    self.mig_list_source = configuration['redirect']['mig_list_src']
+                if configuration['redirect'].get('replay_src') is not None:
+                    self.replay_source = configuration['redirect']['replay_src']
+                    self.replay_speed = configuration['redirect'].get('replay_speed', 1)
 
             
-    def get_process_info(self):
+    def topology(self):
+        # the interconnect matrix only changes with the hardware, so the output
+        # of nvidia-smi topo -m is kept in a file in /dev/shm until reboot.
+        # None if it can not be read, the gpus are then chosen without it.
+        if self.topo is None:
+            from gpuutil.topology import GPUTopology
+            if self.topo_source is not None:
+                topo = GPUTopology.from_text(loadfile(self.topo_source))
+            else:
+                topo_path = os.path.join(os.path.dirname(default_cache_path()), 'topo.txt')
+                topo = None
+                if self.topo_cache and os.path.isfile(topo_path):
+                    topo = GPUTopology.from_text(loadfile(topo_path))
+                if topo is None or len(topo.gpus) == 0:
+                    try:
+                        text = exe_cmd(self.topo_cmd, self.timeouts.get('nvsmi'), check=True)
+                    except Exception:
+                        return None
+                    topo = GPUTopology.from_text(text)
+                    # only an output with gpus in it is kept, an error message would stay until reboot.
+                    if self.topo_cache and len(topo.gpus) > 0:
+                        ensure_shared_dir(os.path.dirname(topo_path))
+                        temp_path = '{0}.{1}.tmp'.format(topo_path, os.getpid())
+                        savefile(temp_path, text)
+                        share_file(temp_path, 0o644)
+                        os.replace(temp_path, topo_path)
+            if len(topo.gpus) == 0:
+                return None
+            self.topo = topo
+        return self.topo
+    def mig_uuids(self):
+        # fill in the uuids of the mig instances from nvidia-smi -L, which
+        # cuda needs in CUDA_VISIBLE_DEVICES. older drivers that do not list
+        # them take MIG-<gpu uuid>/<gpu instance>/<compute instance>.
+        try:
+            if self.mig_list_source is not None:
+                text = loadfile(self.mig_list_source)
+            else:
+                text = exe_cmd(self.mig_list_cmd, self.timeouts.get('nvsmi'))
+        except Exception:
+            text = ''
+        uuids = parse_mig_list(text)
+        for gpu in self.snapshot.devices:
+            for mig in gpu.mig:
+                mig.uuid = uuids.get((gpu.uuid, mig.index), 'MIG-{0}/{1}/{2}'.format(gpu.uuid, mig.gpu_instance, mig.compute_instance))
+    def replayer(self):
+        if self.replay_clock is None:
+            from gpuutil.replay import ReplayClock, SnapshotReplay
+            self.replay_clock = ReplayClock(SnapshotReplay(self.replay_source), self.replay_speed)
+        return self.replay_clock
+    def resolves_by_pid(self):
+        if self.ps_cmd is not None:
+            return self.ps_source is None and '{pids}' in self.ps_cmd
+        return self.ps_source is None and osname == 'Linux'
+    def get_process_info(self, pids=None):
         if self.ps_source is not None:
             return get_basic_process_info_by_file(self.ps_source, self.ps_name_trans)
+        if self.ps_cmd is not None:
+            if '{pids}' in self.ps_cmd:
+                if not pids:
+                    return {}
+                return parse_ps_output(exe_cmd(self.ps_cmd.format(pids=','.join(pids)), self.timeouts.get('ps')))
+            return parse_ps_output(exe_cmd(self.ps_cmd, self.timeouts.get('ps')))
         if osname == 'Windows':
-            return get_basic_process_info_windows()
+            return get_basic_process_info_windows(self.timeouts.get('ps'))
         elif osname == 'Linux':
-            return get_basic_process_info_linux()
+            if pids is not None:
+                return get_process_info_by_pids_linux(pids)
+            return get_basic_process_info_linux(self.timeouts.get('ps'))
+        return {}
+    async def get_process_info_async(self, pids=None):
+        if self.ps_cmd is not None and self.ps_source is None:
+            if '{pids}' in self.ps_cmd:
+                if not pids:
+                    return {}
+                return parse_ps_output(await exe_cmd_async(self.ps_cmd.format(pids=','.join(pids)), self.timeouts.get('ps')))
+            return parse_ps_output(await exe_cmd_async(self.ps_cmd, self.timeouts.get('ps')))
+        if osname == 'Windows' and self.ps_source is None:
+            return parse_tasklist_output(await exe_cmd_async(tasklist_cmd_windows, self.timeouts.get('ps')))
+        elif osname == 'Linux' and self.ps_source is None and pids is None:
+            return parse_ps_output(await exe_cmd_async(ps_cmd_linux, self.timeouts.get('ps')))
+        # files and /proc are read directly.
+        return self.get_process_info(pids)
+    async def parse_async(self):
+        # the shared snapshot cache waits on a file lock, so it is not used here.
+        if self.replay_source is not None:
+            return self.collect()
+        if self.backend not in self.async_collectors:
+            raise ValueError('Unknown backend {0}, avaliable: {1}'.format(self.backend, ','.join(self.async_collectors.keys())))
+        await self.async_collectors[self.backend](self)
+        return self.snapshot
     def parse(self):
-        if self.nvsmi_source is None:
-            self.raw_info = parse_nvsmi_info(exe_cmd('nvidia-smi -q -x'))
+        # raw_info, detailed_info and simplified_info are only filled when
+        # this process collects by itself instead of using the shared cache.
+        if self.cache is not None and not self.full_info and self.replay_source is None:
+            snapshot = self.cache.get(self.collect)
+            # when this process collected it, collect has already set it.
+            if snapshot is not self.snapshot:
+                self.set_snapshot(snapshot)
         else:
-            self.raw_info = parse_nvsmi_info(loadfile(self.nvsmi_source))
+            self.collect()
+    def collect(self):
+        if self.replay_source is not None:
+            self.load_replayed(self.replayer().current())
+            return self.snapshot
+        if self.backend not in self.collectors:
+            raise ValueError('Unknown backend {0}, avaliable: {1}'.format(self.backend, ','.join(self.collectors.keys())))
+        self.collectors[self.backend](self)
+        return self.snapshot
+    def update(self, nvsmixml, process_info=None, errors=None):
+        self.load_xml(nvsmixml)
+        self.update_gpus(process_info, errors)
+    def load_xml(self, nvsmixml):
+        self.raw_info = parse_nvsmi_info(nvsmixml, self.nvsmi_fields)
         self.detailed_info = {}
         for key, value in self.raw_info.items():
             if key != 'gpu':
@@ -356,120 +1597,203 @@ class GPUStat():
                 if type(value) is not list:
                     value = [value]
                 self.detailed_info[key] = [parse_gpu_info(info) for info in value]
-        self.process_info = self.get_process_info()
         self.simplified_info = {}
         for key in self.detailed_info:
             if key != "gpu":
                 self.simplified_info[key] = self.detailed_info[key]
             else:
                 self.simplified_info["gpus"] = [simplify_gpu_info(stat) for stat in self.detailed_info["gpu"]]
+    def update_csv(self, gpu_csv, apps_csv, process_info=None, errors=None):
+        self.load_csv(gpu_csv, apps_csv)
+        self.update_gpus(process_info, errors)
+    def load_csv(self, gpu_csv, apps_csv):
+        self.raw_info = None
+        self.detailed_info = None
+        self.simplified_info = parse_csv_info(gpu_csv, apps_csv)
+    def reported_pids(self):
+        return [process['pid'] for gpu in self.simplified_info["gpus"] for process in gpu['processes']]
+    def pids_to_resolve(self):
+        pids = self.reported_pids()
+        if not self.incremental:
+            return pids
+        return [pid for pid in pids if pid not in self.known_processes]
+    def resolved(self, pids, process_info):
+        # incremental mode: remember what was found for pids and forget the
+        # processes that are gone. pids that were not found are tried again
+        # next time, they may have started after the lookup.
+        if not self.incremental:
+            return process_info
+        for pid in pids:
+            if pid in process_info:
+                self.known_processes[pid] = process_info[pid]
+        reported = set(self.reported_pids())
+        self.known_processes = {pid: info for pid, info in self.known_processes.items() if pid in reported}
+        return self.known_processes
+    async def update_gpus_async(self, process_info=None, errors=None):
+        # same as update_gpus, but waits for the process lookup on the event loop.
+        import asyncio
+        if errors is None:
+            errors = {}
+        if process_info is None and 'ps' not in errors:
+            try:
+                pids = self.pids_to_resolve()
+                found = {}
+                if len(pids) > 0 or not self.incremental:
+                    found = await asyncio.wait_for(self.get_process_info_async(pids), self.timeouts.get('ps'))
+                process_info = self.resolved(pids, found)
+            except Exception as e:
+                errors['ps'] = describe_error(e)
+        self.update_gpus(process_info, errors)
+    def update_failed(self, errors):
+        # nvidia-smi did not answer, keep an empty snapshot that says why.
+        self.raw_info = None
+        self.detailed_info = None
+        self.simplified_info = None
+        self.process_info = None
+        self.set_snapshot(GPUSnapshot([], partial=True, errors=errors))
+    def update_gpus(self, process_info=None, errors=None):
+        if errors is None:
+            errors = {}
+        if process_info is None and 'ps' not in errors:
+            try:
+                pids = self.pids_to_resolve()
+                found = {}
+                if len(pids) > 0 or not self.incremental:
+                    found = self.get_process_info(pids)
+                process_info = self.resolved(pids, found)
+            except Exception as e:
+                errors['ps'] = describe_error(e)
+        self.process_info = {} if process_info is None else process_info
         if "cuda_version" in self.simplified_info:
             self.cuda_version = self.simplified_info["cuda_version"]
         if "driver_version" in self.simplified_info:
             self.driver_version = self.simplified_info["driver_version"]
         if "attached_gpus" in self.simplified_info:
             self.attached_gpus = self.simplified_info["attached_gpus"]
-        self.gpus = []
+        devices = []
         for i, gpu in enumerate(self.simplified_info["gpus"]):
             for process in gpu['processes']:
-               process.update(self.process_info[process['pid']])
+                # the process may exit between the two queries.
+                process.update(self.process_info.get(process['pid'], unknown_process))
             gpu['id'] = i
-            self.gpus.append(gpu)
+            devices.append(GPUDevice.from_dict(gpu))
+        self.set_snapshot(GPUSnapshot(devices, driver_version=self.driver_version, cuda_version=self.cuda_version,
+                                      attached_gpus=self.attached_gpus, partial=len(errors) > 0, errors=errors))
+
+    def load_replayed(self, snapshot):
+        # a replayed sample has no nvidia-smi output behind it.
+        self.raw_info = None
+        self.detailed_info = None
+        self.simplified_info = None
+        self.process_info = None
+        self.set_snapshot(snapshot)
+
+    def set_snapshot(self, snapshot):
+        if self.incremental:
+            if snapshot.partial and len(snapshot.devices) == 0:
+                self.diff = None
+            else:
+                self.diff = None if self.previous is None else diff_snapshots(self.previous, snapshot)
+                self.previous = snapshot
+        self.snapshot = snapshot
+        self.gpu_dicts = None
+        self.driver_version = snapshot.driver_version
+        self.cuda_version = snapshot.cuda_version
+        self.attached_gpus = snapshot.attached_gpus
+
+    @property
+    def gpus(self):
+        # dict views are only built when someone asks for them.
+        if self.snapshot is None:
+            return []
+        if self.gpu_dicts is None:
+            self.gpu_dicts = self.snapshot.to_dicts()
+        return self.gpu_dicts
+
+    def watch(self, interval=1):
+        # yields a GPUSnapshot every time a new sample arrives.
+        if self.replay_source is not None:
+            # ends with the recording.
+            replayer = self.replayer()
+            for wait, i in replayer.schedule():
+                time.sleep(wait)
+                self.load_replayed(replayer.replay.frame(i))
+                yield self.snapshot
+            return
+        if self.nvsmi_source is not None or self.backend != 'xml':
+            # redirected files and the csv backend have no stream, just poll them.
+            while True:
+                self.parse()
+                yield self.snapshot
+                time.sleep(interval)
+        import shlex
+        import subprocess
+        command = self.nvsmi_watch_cmd.format(interval=interval, interval_ms=int(interval * 1000))
+        proc = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
+        splitter = NvsmiStreamSplitter()
+        try:
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if len(chunk) == 0:
+                    break
+                for document in splitter.feed(chunk):
+                    self.update(document)
+                    yield self.snapshot
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+
+    async def watch_async(self, interval=1):
+        # async version of watch, use it with `async for snapshot in stat.watch_async(1)`.
+        import asyncio
+        import shlex
+        import subprocess
+        if self.replay_source is not None:
+            replayer = self.replayer()
+            for wait, i in replayer.schedule():
+                await asyncio.sleep(wait)
+                self.load_replayed(replayer.replay.frame(i))
+                yield self.snapshot
+            return
+        if self.nvsmi_source is not None or self.backend != 'xml':
+            while True:
+                yield await self.parse_async()
+                await asyncio.sleep(interval)
+        command = self.nvsmi_watch_cmd.format(interval=interval, interval_ms=int(interval * 1000))
+        proc = await asyncio.create_subprocess_exec(*shlex.split(command), stdout=subprocess.PIPE)
+        splitter = NvsmiStreamSplitter()
+        try:
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if len(chunk) == 0:
+                    break
+                for document in splitter.feed(chunk):
+                    self.load_xml(document)
+                    await self.update_gpus_async()
+                    yield self.snapshot
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
 
     def show(self, enabled_cols = ['ID', 'Fan', 'Temp', 'Pwr', 'Freq', 'Util', 'Vmem', 'Users'], colsty=None, colsz=None, show_command=True, vertical=False):
         self.parse()
-        gpu_infos = []
-        # stats = {
-        #     "id": stat['id'],
-        #     "fan": stat['fan_speed'].split(' ')[0].strip(),
-        #     "temp_cur":  stat['temperature']['current'].split(' ')[0].strip(),
-        #     "temp_max":  stat['temperature']['max'].split(' ')[0].strip(),
-        #     "power_cur": stat['power']['current'].split(' ')[0].strip(),
-        #     "power_max": stat['power']['max'].split(' ')[0].strip(),
-        #     "clock_cur": stat['clocks']['current'].split(' ')[0].strip(),
-        #     "clock_max": stat['clocks']['max'].split(' ')[0].strip(),
-        #     "util":      stat['utilization'],
-        #     "mem_used":  stat['memory']['used'].split(' ')[0].strip(),
-        #     "mem_total": stat['memory']['total'].split(' ')[0].strip(),
-        #     "mem_free":  stat['memory']['free'].split(' ')[0].strip()
-        # }
-        for gpu in self.gpus:
-            # process_fmt = '{user}({pid})'
-            # process_info = ','.join([process_fmt.format(
-            #     user = proc['user'],
-            #     pid = proc['pid']
-            # ) for proc in gpu['processes']])
-            process_fmt = '{user}({pids})'
-            users_process = {}
-            for proc in gpu['processes']:
-                user = proc['user']
-                pid = proc['pid']
-                if user not in users_process:
-                    users_process[user] = []
-                users_process[user].append(pid)
-            delemeter = ','
-            if vertical:
-                delemeter = '\n'
-            process_info = delemeter.join(process_fmt.format(user=user, pids = '|'.join(users_process[user])) for user in users_process)
-            info_gpu = {
-                'ID': '{0}'.format(str(gpu['id'])),
-                'Fan': '{0} %'.format(gpu['fan_speed'].split(' ')[0].strip()),
-                'Temp': '{0} C'.format(gpu['temperature']['current'].split(' ')[0].strip()),
-                'TempMax': '{0} C'.format(gpu['temperature']['max'].split(' ')[0].strip()),
-                'Pwr': '{0} W'.format(gpu['power']['current'].split(' ')[0].strip()),
-                'PwrMax': '{0} W'.format(gpu['power']['max'].split(' ')[0].strip()),
-                'Freq': '{0} MHz'.format(gpu['clocks']['current'].split(' ')[0].strip()),
-                'FreqMax': '{0} MHz'.format(gpu['clocks']['max'].split(' ')[0].strip()),
-                'Util': '{0} %'.format(gpu['utilization'].split(' ')[0]),
-                'Vmem': '{0}/{1} MiB'.format(
-                    gpu['memory']['used'].split(' ')[0].strip(),
-                    gpu['memory']['total'].split(' ')[0].strip(),
-                ),
-                'UsedMem': '{0} MiB'.format(gpu['memory']['used'].split(' ')[0].strip()),
-                'TotalMem': '{0} MiB'.format(gpu['memory']['total'].split(' ')[0].strip()),
-                'FreeMem': '{0} MiB'.format(gpu['memory']['free'].split(' ')[0].strip()),
-                'Users': process_info
-            }
-            gpu_infos.append(info_gpu)
-        align_methods = {key:'r' for key in gpu_infos[0]}
-        align_methods['Users'] = 'l'
+        print(self.render(enabled_cols=enabled_cols, colsty=colsty, colsz=colsz, show_command=show_command, vertical=vertical))
+
+    def render(self, enabled_cols = ['ID', 'Fan', 'Temp', 'Pwr', 'Freq', 'Util', 'Vmem', 'Users'], colsty=None, colsz=None, show_command=True, vertical=False):
         if enabled_cols is None:
-            enabled_cols = list(align_methods.keys())
-        c_align = [align_methods[col] for col in enabled_cols]
-        info_table = [enabled_cols]
-        for info in gpu_infos:
-            this_row = [info[key] for key in enabled_cols]
-            info_table.append(this_row)
-        info = draw_table(info_table, rowsty='|c|{0}|'.format('c'*(len(info_table)-1)), colsty=colsty, colsz=colsz) + '\n'
-        if show_command:
-            procs = {}
-            for gpu in self.gpus:
-                for proc in gpu['processes']:
-                    pid = proc['pid']
-                    proc['gpu'] = [str(gpu['id'])]
-                    if type(proc['vmem']) is str:
-                        proc['vmem'] = int(proc['vmem'].split(' ')[0])
-                    if pid not in procs:
-                        procs[pid] = proc
-                    else:
-                        procs[pid]['gpu'].append(str(gpu['id']))
-                        procs[pid]['vmem'] += proc['vmem']
-            proc_fmt = '[{pid}|{gpus}] {user}({vmem} MiB) {cmd}'
-            proc_strs = []
-            for pid in procs:
-                this_proc_str = proc_fmt.format(
-                    user = procs[pid]['user'],
-                    vmem = procs[pid]['vmem'],
-                    pid = procs[pid]['pid'].rjust(5),
-                    cmd = procs[pid]['command'],
-                    gpus = ','.join(procs[pid]['gpu'])
-                )
-                proc_strs.append(this_proc_str)
-            proc_info = '\n'.join(proc_strs)
-            table_width = info.find('\n')
-            proc_info = draw_table([['Process Info'.center(table_width-4)], [proc_info]], rowsty="c|c|", colsty="|l|", colsz=[table_width-4])
-            info += proc_info
-        print(info)
+            enabled_cols = list(available_cols)
+        return render_snapshot(self.snapshot, enabled_cols, colsty, colsz, show_command, vertical)
+
+def render_snapshot(snapshot, enabled_cols, colsty=None, colsz=None, show_command=True, vertical=False, formatters=None):
+    info_table = [enabled_cols] + device_rows(snapshot.devices, enabled_cols, vertical, formatters)
+    info = draw_table(info_table, rowsty='|c|{0}|'.format('c'*(len(info_table)-1)), colsty=colsty, colsz=colsz) + '\n'
+    if show_command:
+        info += draw_process_table(process_lines(snapshot.devices), info.find('\n'))
+    if snapshot.partial:
+        info += '\nPartial result: ' + ', '.join('{0} {1}'.format(name, error) for name, error in snapshot.errors.items())
+    return info
 
 class MoreGPUNeededError(Exception):
     def __init__(self):
@@ -504,7 +1828,7 @@ def ask_use_non_empty_gpu(stat, empty, non_empty):
     really_used_gpu = []
     print('No enough free gpu, would you love to use these following non-empty gpu?')
     for gpu in non_empty:
-        print(short_gpu_info(stat.gpus[gpu], disp_type='detail'))
+        print(short_gpu_info(stat.snapshot.devices[gpu], disp_type='detail'))
     hint = 'Y: Use the non-empty gpu\nN: Exit\nM: set gpu mannuly'
     action = choose_interface(['y', 'n', 'm'], default='n', hint=hint, case_sensitive=False)
     if action == 'y':
@@ -517,36 +1841,453 @@ def ask_use_non_empty_gpu(stat, empty, non_empty):
         really_used_gpu = [int(x) for x in really_used_gpu if x != '']
     return really_used_gpu
 
-def auto_set(num, allow_nonfree=True, ask=True, blacklist=[], show=True):
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        # exists, but belongs to someone else.
+        return True
+    except OSError:
+        return False
+    return True
+
+def default_queue_dir():
+    return os.path.join(shared_dir(), 'gpuutil-queue')
+
+class WaitQueue():
+    # processes waiting for gpus on the node take turns in (priority, arrival)
+    # order through ticket files, only the first one may take gpus.
+    def __init__(self, directory=None):
+        self.directory = default_queue_dir() if directory is None else directory
+        self.ticket = None
+    def enter(self, priority=0):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                # shared by all users like /tmp.
+                os.chmod(self.directory, 0o1777)
+            except OSError:
+                pass
+        self.ticket = 'ticket_{0}_{1}_{2}'.format(priority, time.time_ns(), os.getpid())
+        savefile(os.path.join(self.directory, self.ticket), '')
+    def leave(self):
+        if self.ticket is not None:
+            try:
+                os.remove(os.path.join(self.directory, self.ticket))
+            except OSError:
+                pass
+            self.ticket = None
+    def remove_stale(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+    def tickets(self):
+        tickets = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('ticket_'):
+                continue
+            _, priority, arrival, pid = name.split('_')
+            if not pid_alive(int(pid)):
+                self.remove_stale(name)
+                continue
+            tickets.append((-int(priority), int(arrival), int(pid), name))
+        tickets.sort()
+        return [ticket[-1] for ticket in tickets]
+    def is_first(self):
+        tickets = self.tickets()
+        return len(tickets) > 0 and tickets[0] == self.ticket
+    def changed_since(self, mtime):
+        # a ticket was added or removed.
+        return os.stat(self.directory).st_mtime_ns != mtime
+    def mtime(self):
+        return os.stat(self.directory).st_mtime_ns
+
+def default_lease_dir():
+    return os.path.join(shared_dir(), 'gpuutil-leases')
+
+class LeaseManager():
+    # a gpu handed to a job stays leased until the job shows up in nvidia-smi,
+    # so that jobs started at the same time do not pick the same free gpu.
+    # a lease is a file per gpu, holding its owner. it ends when the owner
+    # exits, is released, or is not renewed by heartbeat for ttl seconds.
+    # the file's mtime is the time of the last heartbeat.
+    def __init__(self, directory=None, ttl=60):
+        self.directory = default_lease_dir() if directory is None else directory
+        self.lock_path = os.path.join(self.directory, 'lock')
+        self.ttl = ttl
+        import platform
+        self.host = platform.node()
+    def ensure_directory(self):
+        # anyone must be able to remove a dead lease.
+        ensure_shared_dir(self.directory)
+    def lock(self):
+        # all changes are made while holding this lock, so claiming is atomic.
+        self.ensure_directory()
+        lock = open(self.lock_path, 'a')
+        share_file(self.lock_path)
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+    def path(self, gpu_id):
+        # mig instances ('0/1') are leased as gpu_0_1.lease.
+        return os.path.join(self.directory, 'gpu_{0}.lease'.format(str(gpu_id).replace('/', '_')))
+    def read(self, gpu_id):
+        path = self.path(gpu_id)
+        try:
+            lease = json.loads(loadfile(path))
+            lease['heartbeat'] = os.stat(path).st_mtime
+        except (OSError, ValueError):
+            return None
+        lease['expires'] = lease['heartbeat'] + lease['ttl']
+        lease['valid'] = self.is_valid(lease)
+        return lease
+    def is_valid(self, lease):
+        if time.time() >= lease['expires']:
+            return False
+        # pids of other hosts (the directory may be shared) can not be checked.
+        if lease['pid'] is not None and lease['host'] == self.host:
+            return pid_alive(lease['pid'])
+        return True
+    def leases(self):
+        # all lease files, valid or not, sorted by gpu.
+        if not os.path.isdir(self.directory):
+            return []
+        leases = []
+        for name in os.listdir(self.directory):
+            if name.startswith('gpu_') and name.endswith('.lease'):
+                lease = self.read(name[len('gpu_'):-len('.lease')])
+                if lease is not None:
+                    leases.append(lease)
+        leases.sort(key=lambda lease:str(lease['gpu']))
+        return leases
+    def leased(self):
+        return [lease['gpu'] for lease in self.leases() if lease['valid']]
+    def write(self, gpu_id, pid, ttl):
+        lease = {
+            "gpu": gpu_id,
+            "pid": pid,
+            "host": self.host,
+            "user": uid2name(os.getuid()) if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'N/A'),
+            "created": time.time(),
+            "ttl": ttl,
+        }
+        path = self.path(gpu_id)
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        savefile(temp_path, json.dumps(lease))
+        os.replace(temp_path, path)
+    def claim(self, gpu_ids, num=None, pid='self', ttl=None):
+        # lease the first num gpus of gpu_ids that are not leased yet (all of
+        # them if num is None) and return their ids, or claim nothing and return
+        # None if there are not enough. pid=None makes a lease that only ends
+        # after ttl, not when this process exits.
+        num = len(gpu_ids) if num is None else num
+        pid = os.getpid() if pid == 'self' else pid
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock():
+            leased = self.leased()
+            available = [gpu_id for gpu_id in gpu_ids if gpu_id not in leased]
+            if len(available) < num:
+                return None
+            for gpu_id in available[:num]:
+                self.write(gpu_id, pid, ttl)
+            return available[:num]
+    def claim_first(self, candidates, pid='self', ttl=None):
+        # candidates(excluded) chooses without the excluded gpus and returns
+        # (the gpus to lease, the choice), or None if nothing can be chosen.
+        # another process may lease some of them between the snapshot and the
+        # claim, they are then excluded and the choice is made again. returns
+        # the choice once its gpus are leased, or None.
+        excluded = []
+        while True:
+            choice = candidates(list(excluded))
+            if choice is None:
+                return None
+            gpu_ids, chosen = choice
+            if len(gpu_ids) == 0 or self.claim(gpu_ids, pid=pid, ttl=ttl) is not None:
+                return chosen
+            excluded += [gpu_id for gpu_id in self.leased() if gpu_id not in excluded]
+    def heartbeat(self, gpu_ids=None):
+        # renew the leases of this process, or the given gpus.
+        with self.lock():
+            for lease in self.leases():
+                if gpu_ids is None and (lease['pid'] != os.getpid() or lease['host'] != self.host):
+                    continue
+                if gpu_ids is not None and lease['gpu'] not in gpu_ids:
+                    continue
+                os.utime(self.path(lease['gpu']))
+    def release(self, gpu_ids=None):
+        # end the leases of this process, or the given gpus whoever owns them.
+        with self.lock():
+            for lease in self.leases():
+                if gpu_ids is None and (lease['pid'] != os.getpid() or lease['host'] != self.host):
+                    continue
+                if gpu_ids is not None and lease['gpu'] not in gpu_ids:
+                    continue
+                self.remove(lease['gpu'])
+    def expire(self):
+        # remove the files of leases that are no longer valid.
+        expired = []
+        with self.lock():
+            for lease in self.leases():
+                if not lease['valid']:
+                    self.remove(lease['gpu'])
+                    expired.append(lease['gpu'])
+        return expired
+    def remove(self, gpu_id):
+        try:
+            os.remove(self.path(gpu_id))
+        except OSError:
+            pass
+    def pending(self, snapshot):
+        # leased gpus that have no process yet, nobody else should take them.
+        used = [gpu.id for gpu in snapshot.devices if len(gpu.processes) > 0]
+        used += [mig.id for gpu in snapshot.devices for mig in gpu.mig if len(mig.processes) > 0]
+        return [gpu_id for gpu_id in self.leased() if gpu_id not in used]
+
+def mig_enabled(snapshot):
+    # gpus split into mig instances can not be used as a whole.
+    return [gpu.id for gpu in snapshot.devices if len(gpu.mig) > 0]
+
+def mig_snapshot(snapshot, blacklist=[]):
+    # the mig instances as devices, for select_gpus and place_jobs. blacklist
+    # may hold gpu ids (all their instances) and instance ids.
+    instances = [mig for gpu in snapshot.devices if gpu.id not in blacklist for mig in gpu.mig if mig.id not in blacklist]
+    return GPUSnapshot(instances, timestamp=snapshot.timestamp)
+
+def select_gpus(snapshot, num, blacklist=[], min_free_mem=None, topology=None):
+    # gpus without processes, or with at least min_free_mem MiB free if it is given.
+    # returns None if there are not enough of them. with a GPUTopology, the best
+    # connected ones are chosen.
+    candidates = [gpu for gpu in snapshot.devices if gpu.id not in blacklist]
+    if min_free_mem is None:
+        eligible = [gpu for gpu in candidates if len(gpu.processes) == 0]
+    else:
+        eligible = [gpu for gpu in candidates if (gpu.mem_free or 0) >= min_free_mem]
+    if len(eligible) < num:
+        return None
+    eligible.sort(key=lambda gpu:(len(gpu.processes) > 0, -(gpu.mem_free or 0)))
+    if topology is not None:
+        return topology.best_set([gpu.id for gpu in eligible], num)
+    return [gpu.id for gpu in eligible[:num]]
+
+# MiB kept free on each gpu when placing jobs by memory, for the cuda context
+# and for jobs that grow a little.
+default_mem_margin = 512
+placement_policies = ['best_fit', 'worst_fit', 'spread']
+
+def place_jobs(snapshot, jobs, policy='best_fit', margin=default_mem_margin, blacklist=[], topology=None):
+    # jobs: a list of MiB needed on one gpu, or of (num, MiB) for jobs that need
+    # num gpus with that much free each. returns a list of gpu ids per job, or
+    # None for the jobs that do not fit. jobs may share a gpu, the memory of
+    # the jobs placed before is taken from it. the largest jobs are placed first.
+    #   best_fit: the gpus with the least memory left that still fit, so that
+    #             large holes stay for large jobs.
+    #   worst_fit: the gpus with the most memory left.
+    #   spread: the gpus with the fewest processes (and jobs placed), then the most memory.
+    if policy not in placement_policies:
+        raise ValueError('Unknown policy {0}, avaliable: {1}'.format(policy, ','.join(placement_policies)))
+    jobs = [(1, job) if isinstance(job, (int, float)) else tuple(job) for job in jobs]
+    free = {gpu.id: (gpu.mem_free or 0) - margin for gpu in snapshot.devices if gpu.id not in blacklist}
+    load = {gpu.id: len(gpu.processes) for gpu in snapshot.devices}
+    if policy == 'best_fit':
+        key = lambda gpu_id:(free[gpu_id], gpu_id)
+    elif policy == 'worst_fit':
+        key = lambda gpu_id:(-free[gpu_id], gpu_id)
+    else:
+        key = lambda gpu_id:(load[gpu_id], -free[gpu_id], gpu_id)
+    placements = [None] * len(jobs)
+    for i in sorted(range(len(jobs)), key=lambda i:jobs[i][1], reverse=True):
+        num, mem_required = jobs[i]
+        fits = sorted([gpu_id for gpu_id in free if free[gpu_id] >= mem_required], key=key)
+        if len(fits) < num:
+            continue
+        if topology is not None and num > 1:
+            selected = topology.best_set(fits, num)
+        else:
+            selected = fits[:num]
+        for gpu_id in selected:
+            free[gpu_id] -= mem_required
+            load[gpu_id] += 1
+        placements[i] = selected
+    return placements
+
+def auto_place(jobs, policy='best_fit', margin=default_mem_margin, blacklist=[]):
+    # places many jobs (see place_jobs) from a single query. the gpus that had
+    # no processes are leased for the lease ttl, like wait without a command,
+    # so that other callers leave them to the jobs until these start.
+    stat = GPUStat()
+    stat.parse()
+    leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+    # gpus with mig enabled can not take a job as a whole.
+    blacklist = list(blacklist) + leases.pending(stat.snapshot) + mig_enabled(stat.snapshot)
+    idle = [gpu.id for gpu in stat.snapshot.devices if len(gpu.processes) == 0]
+    def candidates(excluded):
+        placements = place_jobs(stat.snapshot, jobs, policy, margin, blacklist + excluded)
+        return sorted(set(gpu_id for selected in placements if selected is not None for gpu_id in selected if gpu_id in idle)), placements
+    return leases.claim_first(candidates, pid=None)
+
+def wait_and_set(num, timeout=None, min_free_mem=None, blacklist=[], priority=0, interval=1, max_interval=10, show=True, detach=False, topology=False):
+    # block until num gpus are available (see select_gpus) and set them, raises
+    # MoreGPUNeededError after timeout seconds. higher priority goes first.
+    # the gpus are leased to this process, or only for the lease ttl if detach
+    # is set (e.g. when the gpus are handed to another process).
+    # topology: choose the gpus with the fastest links between them.
+    stat = GPUStat()
+    if stat.cache is None:
+        # waiters share one query per interval instead of each polling nvidia-smi.
+        stat.cache = SnapshotCache(ttl=interval)
+    leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+    queue = WaitQueue(stat.queue_dir)
+    queue.enter(priority)
+    deadline = None if timeout is None else time.time() + timeout
+    delay = interval
+    try:
+        while True:
+            if queue.is_first():
+                stat.parse()
+                excluded = list(blacklist) + leases.pending(stat.snapshot) + mig_enabled(stat.snapshot)
+                topo = stat.topology() if topology else None
+                def candidates(leased):
+                    selected = select_gpus(stat.snapshot, num, excluded + leased, min_free_mem, topo)
+                    return None if selected is None else (selected, selected)
+                selected = leases.claim_first(candidates, pid=None if detach else 'self')
+                if selected is not None:
+                    set_gpu(selected, show=show)
+                    return selected
+            # back off while nothing changes, but wake up early when the queue moves.
+            wake_at = time.time() + delay
+            if deadline is not None:
+                if time.time() >= deadline:
+                    raise MoreGPUNeededError
+                wake_at = min(wake_at, deadline)
+            mtime = queue.mtime()
+            while time.time() < wake_at and not queue.changed_since(mtime):
+                time.sleep(min(0.2, max(0, wake_at - time.time())))
+            delay = min(delay * 1.5, max_interval)
+    finally:
+        queue.leave()
+
+def auto_set(num, allow_nonfree=True, ask=True, blacklist=[], show=True, history=None, window=60, max_util=None, topology=False, mem_required=None, policy='best_fit', margin=default_mem_margin, mig=False):
+    # history: a GPUHistory (e.g. filled by a HistorySampler), or True to sample
+    # for window seconds first. with it, a gpu is only free if it was idle for
+    # the whole window, and non-free gpus are ranked by their mean utilization.
+    # free gpus are leased to this process, gpus leased by others are skipped
+    # until their owner shows up in nvidia-smi.
+    # topology: take the free gpus with the fastest links between them (see
+    # nvidia-smi topo -m) instead of random ones.
+    # mem_required: MiB the job needs on each gpu. gpus in use are then shared
+    # if they have that much free after margin, chosen by policy (see place_jobs).
+    # mig: choose among the mig instances instead of the gpus, free ones (or
+    # by mem_required), CUDA_VISIBLE_DEVICES gets their uuids. gpus with mig
+    # enabled are never chosen as a whole.
     stat = GPUStat()
     stat.parse()
-    if num > len(stat.gpus) - len(blacklist):
+    if mig:
+        return auto_set_mig(stat, num, blacklist, show, mem_required, policy, margin)
+    blacklist = list(blacklist) + [x for x in mig_enabled(stat.snapshot) if x not in blacklist]
+    if mem_required is not None:
+        return auto_set_by_memory(stat, num, mem_required, policy, margin, allow_nonfree, blacklist, show, topology)
+    if history is True:
+        from gpuutil.history import collect_history
+        history = collect_history(stat, window)
+    leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+    blacklist = list(blacklist) + [x for x in leases.pending(stat.snapshot) if x not in blacklist]
+    devices = stat.snapshot.devices
+    if num > len([gpu for gpu in devices if gpu.id not in blacklist]):
         raise MoreGPUNeededError
-    gpus = {int(gpu['id']):int(gpu['memory']['free'].split(' ')[0].strip()) for gpu in stat.gpus}
+    gpus = {gpu.id:(gpu.mem_free or 0) for gpu in devices}
     gpus = {key:value for key, value in gpus.items() if key not in blacklist}
-    free_gpus = [int(gpu['id']) for gpu in stat.gpus if len(gpu['processes']) == 0]
+    free_gpus = [gpu.id for gpu in devices if len(gpu.processes) == 0]
     free_gpus = [x for x in free_gpus if x not in blacklist]
-    selected_gpu = []
+    if history is not None:
+        idle_gpus = history.idle_gpus(window, max_util)
+        free_gpus = [x for x in free_gpus if x in idle_gpus]
+        mean_util = {}
+        for key in gpus:
+            stats = history.stats(key, window)
+            mean_util[key] = stats['mean_util'] if stats is not None and stats['mean_util'] is not None else 100
+    selected_gpu = None
     if num <= len(free_gpus):
         # random select num gpu from all free_gpus.
+        import random
         random.shuffle(free_gpus)
-        selected_gpu = free_gpus[:num]
-    elif allow_nonfree:
+        topo = stat.topology() if topology else None
+        if topo is not None:
+            best = topo.best_set(free_gpus, num)
+            free_gpus = best + [x for x in free_gpus if x not in best]
+        # another process may have leased some of them since the snapshot.
+        selected_gpu = leases.claim(free_gpus, num)
+        if selected_gpu is None:
+            leased = leases.leased()
+            free_gpus = [x for x in free_gpus if x not in leased]
+            gpus = {key:value for key, value in gpus.items() if key not in leased}
+    if selected_gpu is None:
+        if not allow_nonfree:
+            raise MoreGPUNeededError
         # find the gpu with most memory.
         nonfree_gpus = [[key,value] for key, value in gpus.items() if key not in free_gpus]
         nonfree_gpus.sort(key=lambda x:x[1], reverse=True)
+        if history is not None:
+            # the least used first, memory breaks ties since the sort is stable.
+            nonfree_gpus.sort(key=lambda x:mean_util[x[0]])
         nonfree_gpus = [x[0] for x in nonfree_gpus]
         print('nonfree_gpus:', nonfree_gpus)
         num_remeaning = num - len(free_gpus)
         nonfree_gpus_used = nonfree_gpus[:num_remeaning]
         print('nonfree_gpus_used:', nonfree_gpus_used)
         if not ask:
-            selected_gpu = free_gpus + nonfree_gpus_used
+            chosen = free_gpus + nonfree_gpus_used
         else:
-            selected_gpu = ask_use_non_empty_gpu(stat, free_gpus, nonfree_gpus_used)
-    else:
+            chosen = ask_use_non_empty_gpu(stat, free_gpus, nonfree_gpus_used)
+        # asked once: a retry only drops the free gpus that another process
+        # leased meanwhile. without ask, the next gpus in use take their place.
+        def candidates(leased):
+            selected = [x for x in chosen if x not in free_gpus or x not in leased]
+            if not ask:
+                spare = [x for x in nonfree_gpus if x not in selected]
+                selected += spare[:num - len(selected)]
+            # the gpus in use are not leased, their processes already keep others away.
+            return [x for x in selected if x in free_gpus], selected
+        selected_gpu = leases.claim_first(candidates)
+    set_gpu(selected_gpu, show=show)
+    return selected_gpu
+
+def auto_set_by_memory(stat, num, mem_required, policy, margin, allow_nonfree, blacklist, show, topology):
+    leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+    blacklist = list(blacklist) + leases.pending(stat.snapshot)
+    idle = [gpu.id for gpu in stat.snapshot.devices if len(gpu.processes) == 0]
+    if not allow_nonfree:
+        blacklist += [gpu.id for gpu in stat.snapshot.devices if gpu.id not in idle]
+    topo = stat.topology() if topology else None
+    def candidates(excluded):
+        selected = place_jobs(stat.snapshot, [(num, mem_required)], policy, margin, blacklist + excluded, topo)[0]
+        # the gpus in use are not leased, their processes already keep others away.
+        return None if selected is None else ([x for x in selected if x in idle], selected)
+    selected_gpu = leases.claim_first(candidates)
+    if selected_gpu is None:
         raise MoreGPUNeededError
     set_gpu(selected_gpu, show=show)
+    return selected_gpu
+
+def auto_set_mig(stat, num, blacklist, show, mem_required, policy, margin):
+    leases = LeaseManager(stat.lease_dir, stat.lease_ttl)
+    stat.mig_uuids()
+    instances = mig_snapshot(stat.snapshot, blacklist)
+    uuids = {mig.id: mig.uuid for mig in instances.devices}
+    idle = [mig.id for mig in instances.devices if len(mig.processes) == 0]
+    pending = leases.pending(stat.snapshot)
+    def candidates(excluded):
+        if mem_required is None:
+            selected = select_gpus(instances, num, pending + excluded)
+        else:
+            selected = place_jobs(instances, [(num, mem_required)], policy, margin, pending + excluded)[0]
+        return None if selected is None else ([x for x in selected if x in idle], selected)
+    selected = leases.claim_first(candidates)
+    if selected is None:
+        raise MoreGPUNeededError
+    set_gpu([uuids[x] for x in selected], show=show)
+    return selected
 
 if __name__ == '__main__':
     print(get_basic_process_info_windows())
\ No newline at end of file
@@ -0,0 +1,150 @@
+from array import array
+import math
+import threading
+import time
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+nan = float('nan')
+
+def percentile(values, q):
+    # linear interpolation, same as numpy's default.
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    pos = (len(values) - 1) * q / 100
+    low = int(math.floor(pos))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+class GPUHistory():
+    # fixed size ring buffers of per-gpu samples, the oldest ones are overwritten.
+    # the buffers are plain arrays, numpy (if installed) reads them without a copy.
+    metrics = ['util', 'mem_used', 'power', 'nproc']
+    def __init__(self, capacity=3600, busy_util=5):
+        self.capacity = capacity
+        # a sample counts as busy if it has processes or more utilization than this.
+        self.busy_util = busy_util
+        self.timestamps = array('d', [nan] * capacity)
+        self.buffers = {}
+        self.pos = 0
+        self.count = 0
+        self.lock = threading.Lock()
+    def new_buffers(self):
+        return {metric: array('d', [nan] * self.capacity) for metric in self.metrics}
+    def add(self, snapshot):
+        with self.lock:
+            i = self.pos
+            self.timestamps[i] = snapshot.timestamp
+            for buffers in self.buffers.values():
+                for metric in self.metrics:
+                    buffers[metric][i] = nan
+            for gpu in snapshot.devices:
+                if gpu.id not in self.buffers:
+                    self.buffers[gpu.id] = self.new_buffers()
+                buffers = self.buffers[gpu.id]
+                buffers['util'][i] = nan if gpu.util is None else gpu.util
+                buffers['mem_used'][i] = nan if gpu.mem_used is None else gpu.mem_used
+                buffers['power'][i] = nan if gpu.power is None else gpu.power
+                buffers['nproc'][i] = len(gpu.processes)
+            self.pos = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+    def gpu_ids(self):
+        return list(self.buffers.keys())
+    def stats(self, gpu_id, window=None, now=None):
+        # mean/p95 of util, mem_used and power over the last window seconds,
+        # the number of busy samples, and idle_time: seconds since the gpu was
+        # last busy (or since the oldest sample in the window if it was never busy).
+        if now is None:
+            now = time.time()
+        since = -math.inf if window is None else now - window
+        with self.lock:
+            if gpu_id not in self.buffers or self.count == 0:
+                return None
+            if np is not None:
+                return self.stats_numpy(self.buffers[gpu_id], since, now)
+            return self.stats_python(self.buffers[gpu_id], since, now)
+    def stats_numpy(self, buffers, since, now):
+        timestamps = np.frombuffer(self.timestamps, dtype=np.float64)
+        mask = timestamps >= since
+        if not mask.any():
+            return None
+        values = {metric: np.frombuffer(buffers[metric], dtype=np.float64)[mask] for metric in self.metrics}
+        times = timestamps[mask]
+        stats = {'samples': int(mask.sum())}
+        for metric in ['util', 'mem_used', 'power']:
+            valid = values[metric][~np.isnan(values[metric])]
+            stats['mean_' + metric] = float(valid.mean()) if len(valid) > 0 else None
+            stats['p95_' + metric] = float(np.percentile(valid, 95)) if len(valid) > 0 else None
+        busy = (values['nproc'] > 0) | (values['util'] > self.busy_util)
+        last_busy = times[busy].max() if busy.any() else times.min()
+        stats['busy_samples'] = int(busy.sum())
+        stats['idle_time'] = float(now - last_busy)
+        return stats
+    def stats_python(self, buffers, since, now):
+        selected = [i for i, t in enumerate(self.timestamps) if t >= since]
+        if len(selected) == 0:
+            return None
+        stats = {'samples': len(selected)}
+        for metric in ['util', 'mem_used', 'power']:
+            valid = [buffers[metric][i] for i in selected if not math.isnan(buffers[metric][i])]
+            stats['mean_' + metric] = sum(valid) / len(valid) if len(valid) > 0 else None
+            stats['p95_' + metric] = percentile(valid, 95)
+        busy = [self.timestamps[i] for i in selected if buffers['nproc'][i] > 0 or buffers['util'][i] > self.busy_util]
+        last_busy = max(busy) if len(busy) > 0 else min(self.timestamps[i] for i in selected)
+        stats['busy_samples'] = len(busy)
+        stats['idle_time'] = now - last_busy
+        return stats
+    def idle_gpus(self, window, max_util=None):
+        # gpus that were not busy at all during the last window seconds.
+        idle = []
+        for gpu_id in self.gpu_ids():
+            stats = self.stats(gpu_id, window)
+            if stats is None or stats['busy_samples'] > 0:
+                continue
+            if max_util is not None and stats['p95_util'] is not None and stats['p95_util'] > max_util:
+                continue
+            idle.append(gpu_id)
+        return idle
+
+class HistorySampler():
+    # fills a GPUHistory from stat.watch in a background thread.
+    def __init__(self, stat, history=None, interval=1):
+        self.stat = stat
+        self.history = GPUHistory() if history is None else history
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+    def run(self):
+        samples = self.stat.watch(self.interval)
+        try:
+            for snapshot in samples:
+                self.history.add(snapshot)
+                if self.stopped.is_set():
+                    break
+        finally:
+            samples.close()
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+def collect_history(stat, window, interval=1):
+    # sample for window seconds in the foreground and return the history.
+    history = GPUHistory(capacity=max(1, int(window / interval)) + 1)
+    end = time.time() + window
+    samples = stat.watch(interval)
+    try:
+        for snapshot in samples:
+            history.add(snapshot)
+            if time.time() >= end:
+                break
+    finally:
+        samples.close()
+    return history
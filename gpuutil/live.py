@@ -0,0 +1,132 @@
+from gpuutil.gpuutil import available_cols, cell_width, device_rows, draw_process_table, draw_table, process_lines, wrap_cell
+
+def move_to(line, column=0):
+    # ansi cursor position, 1-based.
+    return '\x1b[{0};{1}H'.format(line + 1, column + 1)
+
+clear_screen = '\x1b[H\x1b[2J'
+clear_line_end = '\x1b[K'
+clear_screen_end = '\x1b[J'
+
+class LiveRenderer():
+    # draws snapshots in place on an ansi terminal, like top. the layout of the
+    # last frame (column widths, row heights) is kept, and as long as the new
+    # values still fit in it, only the cells and process lines that changed are
+    # rewritten. the whole screen is only redrawn when the layout changes.
+    def __init__(self, enabled_cols=None, colsty=None, colsz=None, show_command=True, vertical=False):
+        self.enabled_cols = list(available_cols) if enabled_cols is None else enabled_cols
+        self.colsty = '|' + '|'.join(['c'] * len(self.enabled_cols)) + '|' if colsty is None else colsty
+        self.colsz = [None] * len(self.enabled_cols) if colsz is None else colsz
+        self.show_command = show_command
+        self.vertical = vertical
+        self.table = None
+        self.widths = None
+        self.lengths = None
+        self.heights = None
+        self.tail = None
+        self.table_lines = 0
+        self.table_width = 0
+
+    def cells(self, snapshot):
+        return [list(self.enabled_cols)] + device_rows(snapshot.devices, self.enabled_cols, self.vertical)
+
+    def column_width(self, table, i):
+        width = max(cell_width(row[i]) for row in table)
+        if self.colsz[i] is not None and self.colsz[i] < width:
+            width = self.colsz[i]
+        return width
+
+    def aligns(self):
+        return [ch for ch in self.colsty if ch in ['c', 'l', 'r']]
+
+    def row_heights(self, table):
+        aligns = self.aligns()
+        return [max([len(wrap_cell(word, align, width)) for word, align, width in zip(row, aligns, self.widths)] + [1]) for row in table]
+
+    def column_offsets(self):
+        # where each cell starts in a line of draw_table.
+        offsets = []
+        pos = 0
+        col = 0
+        for ch in self.colsty:
+            if ch == '|':
+                pos += 2
+            elif ch in ['c', 'l', 'r']:
+                offsets.append(pos)
+                pos += self.widths[col] + 1
+                col += 1
+        return offsets
+
+    def row_offsets(self):
+        # the first screen line of each table row, separators take a line too.
+        rowsty = '|c|{0}|'.format('c' * (len(self.table) - 1))
+        offsets = []
+        line = 0
+        row = 0
+        for ch in rowsty:
+            if ch == '|':
+                line += 1
+            else:
+                offsets.append(line)
+                line += self.heights[row]
+                row += 1
+        return offsets, line
+
+    def tail_lines(self, snapshot):
+        # the lines under the table, the same as GPUStat.render.
+        tail = ''
+        if self.show_command:
+            tail += draw_process_table(process_lines(snapshot.devices), self.table_width)
+        if snapshot.partial:
+            tail += '\nPartial result: ' + ', '.join('{0} {1}'.format(name, error) for name, error in snapshot.errors.items())
+        return tail.split('\n')
+
+    def redraw(self, snapshot, table):
+        self.table = table
+        self.widths = [self.column_width(table, i) for i in range(len(self.enabled_cols))]
+        self.lengths = [[cell_width(word) for word in row] for row in table]
+        self.heights = self.row_heights(table)
+        text = draw_table(table, rowsty='|c|{0}|'.format('c' * (len(table) - 1)), colsty=self.colsty, colsz=self.colsz)
+        self.table_lines = text.count('\n') + 1
+        self.table_width = text.find('\n')
+        self.tail = self.tail_lines(snapshot)
+        return clear_screen + '\n'.join([text] + self.tail) + '\n'
+
+    def frame(self, snapshot):
+        # the ansi output that turns the previous frame into this snapshot.
+        table = self.cells(snapshot)
+        if self.table is None or len(table) != len(self.table):
+            return self.redraw(snapshot, table)
+        lengths = [[cell_width(word) for word in row] for row in table]
+        # a column only needs a new width if one of its cells changed length.
+        for i in range(len(self.enabled_cols)):
+            if any(new[i] != old[i] for new, old in zip(lengths, self.lengths)):
+                if self.column_width(table, i) != self.widths[i]:
+                    return self.redraw(snapshot, table)
+        if self.row_heights(table) != self.heights:
+            return self.redraw(snapshot, table)
+        self.lengths = lengths
+        out = []
+        aligns = self.aligns()
+        columns = self.column_offsets()
+        rows, _ = self.row_offsets()
+        for r, (new_row, old_row) in enumerate(zip(table, self.table)):
+            for c, (new, old) in enumerate(zip(new_row, old_row)):
+                if new == old:
+                    continue
+                lines = wrap_cell(new, aligns[c], self.widths[c])
+                lines += [' ' * self.widths[c]] * (self.heights[r] - len(lines))
+                for j, line in enumerate(lines):
+                    out.append(move_to(rows[r] + j, columns[c]) + line)
+        self.table = table
+        # the process table and the rest, line by line.
+        tail = self.tail_lines(snapshot)
+        for i, line in enumerate(tail):
+            if i >= len(self.tail) or line != self.tail[i]:
+                out.append(move_to(self.table_lines + i) + line + clear_line_end)
+        end = self.table_lines + len(tail)
+        if len(tail) < len(self.tail):
+            out.append(move_to(end) + clear_screen_end)
+        self.tail = tail
+        out.append(move_to(end))
+        return ''.join(out)
@@ -0,0 +1,127 @@
+import json
+import os
+from gpuutil.gpuutil import available_cols, device_formatters, loaddict, render_snapshot
+
+# the profiles of ~/.gpuutil.conf, checked and with their style parsed, are
+# kept in ~/.gpuutil.conf.plans together with the mtime of the config they
+# come from. a profile is then shown without looking at the rest of the
+# config, and the plans are compiled again whenever the config changes.
+
+# style format: |c|l:15|r|c:14rl:13|
+def parse_style(style):
+    if style is None:
+        return None, None
+    components = []
+    limits = []
+    while len(style) > 0:
+        ch = style[0]
+        if ch == '|':
+            components.append(ch)
+            style = style[1:]
+            continue
+        elif ch in ['l', 'r', 'c']:
+            limit = None
+            style = style[1:]
+            if style[0] == ':':
+                style = style[1:]
+                digits = ''
+                while style[0].isdigit():
+                    digits += style[0]
+                    style = style[1:]
+                if digits != '':
+                    limit = int(digits)
+            components.append(ch)
+            limits.append(limit)
+    style = ''.join(components)
+    return style, limits
+
+def check_cols(cols):
+    unexpected_cols = [col for col in cols if col not in available_cols]
+    if len(unexpected_cols) > 0:
+        raise ValueError('Unexpected cols {0} occured. Cols must be chosen from {1}'.format(unexpected_cols, ','.join(available_cols)))
+
+class RenderPlan():
+    # what a profile shows: the columns with their formatters, the alignment
+    # and the width limit of each column.
+    def __init__(self, cols, colsty=None, colsz=None, show_command=True, vertical=False):
+        check_cols(cols)
+        self.cols = list(cols)
+        self.colsty = '|' + '|'.join(['c'] * len(self.cols)) + '|' if colsty is None else colsty
+        self.colsz = [None] * len(self.cols) if colsz is None else colsz
+        aligns = [ch for ch in self.colsty if ch in ['c', 'l', 'r']]
+        if len(aligns) != len(self.cols) or len(self.colsz) != len(self.cols):
+            raise ValueError('The style {0} has {1} columns, but {2} cols are shown'.format(self.colsty, len(aligns), len(self.cols)))
+        self.show_command = show_command
+        self.vertical = vertical
+        self.formatters = device_formatters(self.cols)
+    @classmethod
+    def from_profile(cls, params):
+        # a profile saved by --save, its style is already parsed.
+        return cls(params['cols'], params.get('style'), params.get('limit'), params.get('show-process', True), params.get('vertical', False))
+    def to_record(self):
+        return {'cols': self.cols, 'colsty': self.colsty, 'colsz': self.colsz, 'show_command': self.show_command, 'vertical': self.vertical}
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['cols'], record['colsty'], record['colsz'], record['show_command'], record['vertical'])
+    def render(self, snapshot):
+        return render_snapshot(snapshot, self.cols, self.colsty, self.colsz, self.show_command, self.vertical, self.formatters)
+
+def default_config_path():
+    return os.path.expanduser('~/.gpuutil.conf')
+
+def plans_path(config_path):
+    return config_path + '.plans'
+
+def is_profile(value):
+    return isinstance(value, dict) and 'cols' in value
+
+def compile_plans(config_path=None):
+    # compiles every profile of the config and saves them, returns {profile: plan}.
+    config_path = default_config_path() if config_path is None else config_path
+    mtime = os.stat(config_path).st_mtime_ns
+    config = loaddict(config_path)
+    plans = {}
+    records = {}
+    for name, params in config.items():
+        if is_profile(params):
+            # a broken profile only fails when it is used.
+            try:
+                plans[name] = RenderPlan.from_profile(params)
+                records[name] = plans[name].to_record()
+            except ValueError as e:
+                plans[name] = records[name] = {'error': str(e)}
+    path = plans_path(config_path)
+    temp = '{0}.{1}'.format(path, os.getpid())
+    try:
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({'mtime_ns': mtime, 'plans': records}, f)
+        # readers see either the old plans or the new ones.
+        os.replace(temp, path)
+    except OSError:
+        # e.g. a read only home, the plans are just not cached.
+        if os.path.exists(temp):
+            os.remove(temp)
+    return plans
+
+def load_plan(profile, config_path=None):
+    # the plan of a profile, None if there is no such profile.
+    config_path = default_config_path() if config_path is None else config_path
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        cached = loaddict(plans_path(config_path))
+        if cached.get('mtime_ns') == mtime:
+            return plan_of(cached['plans'].get(profile))
+    except (OSError, json.JSONDecodeError, AttributeError, KeyError, TypeError):
+        # no plans yet, or not readable, they are compiled again.
+        pass
+    return plan_of(compile_plans(config_path).get(profile))
+
+def plan_of(record):
+    if record is None or isinstance(record, RenderPlan):
+        return record
+    if 'error' in record:
+        raise ValueError(record['error'])
+    return RenderPlan.from_record(record)
@@ -0,0 +1,190 @@
+from array import array
+from bisect import bisect_right
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from gpuutil.gpuutil import GPUSnapshot
+
+# layout of a recording:
+#   header: magic, dictionary length, dictionary (the first sample as json)
+#   frames: timestamp, length, the sample as json compressed with the dictionary
+#   index:  timestamp, offset, length of every frame
+#   footer: offset of the index, number of frames, magic
+# samples of the same machine are mostly the same text, so compressing each
+# frame against the first one makes them small while any frame can still be
+# read by itself. a recording that was not closed has no index, its frames
+# are found by walking the frame headers.
+file_magic = b'GPUREC\x01\x00'
+index_magic = b'GPUIDX\x01\x00'
+header_struct = struct.Struct('<8sI')
+frame_struct = struct.Struct('<dI')
+index_struct = struct.Struct('<dQI')
+footer_struct = struct.Struct('<QI8s')
+# zlib only looks at the last 32k of a dictionary.
+max_dictionary = 32768
+
+def encode_snapshot(snapshot):
+    return json.dumps(snapshot.to_record(), separators=(',', ':')).encode('utf-8')
+
+class SnapshotRecorder():
+    # with SnapshotRecorder(path) as recorder: recorder.write(snapshot)
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self.file = open(path, 'wb')
+        self.dictionary = None
+        self.timestamps = array('d')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+    def write(self, snapshot):
+        data = encode_snapshot(snapshot)
+        if self.dictionary is None:
+            self.dictionary = data[-max_dictionary:]
+            self.file.write(header_struct.pack(file_magic, len(self.dictionary)) + self.dictionary)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        data = compressor.compress(data) + compressor.flush()
+        offset = self.file.tell()
+        self.file.write(frame_struct.pack(snapshot.timestamp, len(data)) + data)
+        self.file.flush()
+        self.timestamps.append(snapshot.timestamp)
+        self.offsets.append(offset + frame_struct.size)
+        self.lengths.append(len(data))
+    def __len__(self):
+        return len(self.timestamps)
+    def close(self):
+        if self.file is None:
+            return
+        if self.dictionary is not None:
+            offset = self.file.tell()
+            self.file.write(b''.join(index_struct.pack(*entry) for entry in zip(self.timestamps, self.offsets, self.lengths)))
+            self.file.write(footer_struct.pack(offset, len(self.timestamps), index_magic))
+        self.file.close()
+        self.file = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+class SnapshotReplay():
+    # random access to the samples of a recording, by position or by time.
+    def __init__(self, path):
+        self.path = path
+        self.timestamps = array('d')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.buffer = None
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < header_struct.size:
+                raise ValueError('{0} is not a gpuutil recording'.format(path))
+            self.buffer = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        magic, length = header_struct.unpack_from(self.buffer, 0)
+        if magic != file_magic:
+            raise ValueError('{0} is not a gpuutil recording'.format(path))
+        self.dictionary = self.buffer[header_struct.size:header_struct.size + length]
+        if not self.load_index():
+            self.scan(header_struct.size + length)
+    def load_index(self):
+        size = len(self.buffer)
+        if size < footer_struct.size:
+            return False
+        offset, count, magic = footer_struct.unpack_from(self.buffer, size - footer_struct.size)
+        if magic != index_magic or offset + count * index_struct.size != size - footer_struct.size:
+            return False
+        for timestamp, frame_offset, length in index_struct.iter_unpack(self.buffer[offset:offset + count * index_struct.size]):
+            self.timestamps.append(timestamp)
+            self.offsets.append(frame_offset)
+            self.lengths.append(length)
+        return True
+    def scan(self, offset):
+        # the recorder was killed, walk the frames up to the last complete one.
+        size = len(self.buffer)
+        while offset + frame_struct.size <= size:
+            timestamp, length = frame_struct.unpack_from(self.buffer, offset)
+            offset += frame_struct.size
+            if offset + length > size:
+                break
+            self.timestamps.append(timestamp)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            offset += length
+    def __len__(self):
+        return len(self.timestamps)
+    def start(self):
+        return self.timestamps[0] if len(self) > 0 else None
+    def end(self):
+        return self.timestamps[-1] if len(self) > 0 else None
+    def find(self, timestamp):
+        # the last frame taken at or before timestamp, or the first one.
+        return max(bisect_right(self.timestamps, timestamp) - 1, 0)
+    def frame(self, i):
+        data = self.buffer[self.offsets[i]:self.offsets[i] + self.lengths[i]]
+        data = zlib.decompressobj(zdict=self.dictionary).decompress(data)
+        return GPUSnapshot.from_record(json.loads(data.decode('utf-8')))
+    def at(self, timestamp):
+        return self.frame(self.find(timestamp))
+    def frames(self, start=0, end=None):
+        for i in range(start, len(self) if end is None else end):
+            yield self.frame(i)
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+class ReplayClock():
+    # plays a recording speed times faster than it was recorded, starting from
+    # its first sample the first time it is asked for one. a speed of 0 plays
+    # it as fast as it is read: every sample is the next frame.
+    # the samples keep the time they were recorded at.
+    def __init__(self, replay, speed=1):
+        self.replay = replay
+        self.speed = speed
+        self.started = None
+        self.next = 0
+    def position(self):
+        # the recording time that corresponds to now.
+        if self.started is None:
+            self.started = time.time()
+        return self.replay.start() + (time.time() - self.started) * self.speed
+    def current(self):
+        if len(self.replay) == 0:
+            raise ValueError('{0} has no samples'.format(self.replay.path))
+        if self.speed == 0:
+            i = min(self.next, len(self.replay) - 1)
+            self.next = i + 1
+            return self.replay.frame(i)
+        return self.replay.frame(self.replay.find(self.position()))
+    def schedule(self):
+        # (seconds to wait, frame) for the frames from the current one to the
+        # last one, waits are from the start so they do not add up errors.
+        if len(self.replay) == 0:
+            return
+        first = self.next if self.speed == 0 else self.replay.find(self.position())
+        start = time.time()
+        for i in range(first, len(self.replay)):
+            self.next = i + 1
+            if self.speed == 0:
+                yield 0, i
+            else:
+                due = start + (self.replay.timestamps[i] - self.replay.timestamps[first]) / self.speed
+                yield max(due - time.time(), 0), i
+
+def record_snapshots(stat, path, interval=1, count=None, duration=None):
+    # record a sample every interval seconds, until count samples or duration
+    # seconds are recorded or until interrupted. returns the number of samples.
+    started = time.time()
+    samples = stat.watch(interval)
+    with SnapshotRecorder(path) as recorder:
+        try:
+            for snapshot in samples:
+                recorder.write(snapshot)
+                if count is not None and len(recorder) >= count:
+                    break
+                if duration is not None and time.time() - started >= duration:
+                    break
+        finally:
+            samples.close()
+        return len(recorder)
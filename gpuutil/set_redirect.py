@@ -6,7 +6,16 @@ availabel_name_trans = ['command', 'user', 'pid']
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--nvsmi', '-nv', default=None, type=str, help='a file indicates real nvidia-smi -q -x output.')
+parser.add_argument('--gpu_csv', '-gc', default=None, type=str, help='a file indicates real nvidia-smi --query-gpu output, used by the csv backend.')
+parser.add_argument('--apps_csv', '-ac', default=None, type=str, help='a file indicates real nvidia-smi --query-compute-apps output, used by the csv backend.')
+parser.add_argument('--backend', '-b', default=None, type=str, choices=['xml', 'csv'], help='which nvidia-smi output to collect, xml (-q -x) or csv (--query-gpu).')
+parser.add_argument('--topo', '-tp', default=None, type=str, help='a file indicates real nvidia-smi topo -m output.')
+parser.add_argument('--mig_list', '-ml', default=None, type=str, help='a file indicates real nvidia-smi -L output, for the uuids of mig instances.')
+parser.add_argument('--replay', '-rp', default=None, type=str, help='a file recorded by python -m gpuutil record, replayed instead of querying nvidia-smi and ps.')
+parser.add_argument('--replay_speed', '-rs', default=1, type=float, help='how many times faster than recorded to replay, 0 gives the next sample on every query.')
 parser.add_argument('--ps', '-ps', default=None, type=str, help='a file indicates real ps-like output.')
+parser.add_argument('--nvsmi_watch_cmd', '-nvw', default=None, type=str, help='command used by watch mode instead of nvidia-smi -q -x -lms {interval_ms}, \
+                                                                            {interval} and {interval_ms} are replaced by the refresh interval.')
 parser.add_argument('--ps_name_trans', '-pst', default=None, type=str, help='a dict of name trans, \
                                                                             format: name1=buildin,name2=buildin, \
                                                                             buildin can be choosen from {0}'.format(','.join(availabel_name_trans)))
@@ -36,7 +45,21 @@ if os.path.isfile(config_file):
 configuration['redirect'] = {
     "nvsmi_src": args.nvsmi,
     "ps_src": args.ps,
-    "ps_name_trans": parsed_name_trans
+    "ps_name_trans": parsed_name_trans,
+    "nvsmi_watch_cmd": args.nvsmi_watch_cmd,
+    "gpu_csv_src": args.gpu_csv,
+    "apps_csv_src": args.apps_csv,
+    "topo_src": args.topo,
+    "mig_list_src": args.mig_list,
+    "replay_src": args.replay,
+    "replay_speed": args.replay_speed
 }
+if args.backend is not None:
+    configuration['backend'] = args.backend
+elif args.gpu_csv is not None or args.apps_csv is not None:
+    configuration['backend'] = 'csv'
+elif args.nvsmi is not None:
+    # the backend of an earlier csv redirect would ignore this file.
+    configuration['backend'] = 'xml'
 
 savedict(config_file, configuration)
\ No newline at end of file
@@ -0,0 +1,97 @@
+from itertools import combinations
+import re
+
+# relative cost of the link between two gpus, as printed by nvidia-smi topo -m.
+# NV# links cost less the more links are bonded, see link_cost.
+link_costs = {
+    'X': 0,
+    'PIX': 2,
+    'PXB': 3,
+    'PHB': 4,
+    'NODE': 5,
+    'SYS': 6,
+}
+unknown_link_cost = 7
+# above this many candidate sets, best_set picks greedily instead of trying all.
+max_exhaustive_sets = 20000
+
+def link_cost(link):
+    if link.startswith('NV'):
+        try:
+            return 1 / int(link[2:])
+        except ValueError:
+            return 1
+    return link_costs.get(link, unknown_link_cost)
+
+def parse_topo(text):
+    # returns the gpu ids, {(a, b): link} and {gpu id: {column: value}} for the
+    # non-gpu columns (cpu and numa affinity). nic rows and columns are ignored.
+    text = re.sub(r'\x1b\[[0-9;]*m', '', text)
+    header = None
+    gpus = []
+    links = {}
+    affinity = {}
+    for line in text.splitlines():
+        if line.strip() == '' or line.startswith('Legend'):
+            if header is not None:
+                break
+            continue
+        if header is None:
+            # column names may contain spaces, but are separated by tabs.
+            header = [col.strip() for col in line.split('\t') if col.strip() != '']
+            continue
+        values = line.split()
+        if not values[0].startswith('GPU'):
+            continue
+        gpu = int(values[0][len('GPU'):])
+        gpus.append(gpu)
+        affinity[gpu] = {}
+        for col, value in zip(header, values[1:]):
+            if col.startswith('GPU') and col[len('GPU'):].isdigit():
+                links[(gpu, int(col[len('GPU'):]))] = value
+            elif not col.startswith('NIC'):
+                affinity[gpu][col] = value
+    return gpus, links, affinity
+
+class GPUTopology():
+    def __init__(self, gpus, links, affinity=None):
+        self.gpus = gpus
+        self.links = links
+        self.affinity = {} if affinity is None else affinity
+    @classmethod
+    def from_text(cls, text):
+        return cls(*parse_topo(text))
+    def link(self, a, b):
+        return self.links.get((a, b), 'N/A')
+    def cost(self, a, b):
+        if a == b:
+            return 0
+        return link_cost(self.link(a, b))
+    def set_cost(self, gpus):
+        # the slowest link bounds collective operations, the total breaks ties.
+        costs = [self.cost(a, b) for a, b in combinations(gpus, 2)]
+        if len(costs) == 0:
+            return (0, 0)
+        return (max(costs), sum(costs))
+    def best_set(self, candidates, num):
+        # the num gpus of candidates that are the best connected to each other.
+        candidates = list(candidates)
+        if num > len(candidates):
+            return None
+        if num <= 1:
+            return candidates[:num]
+        sets = 1
+        for i in range(num):
+            sets = sets * (len(candidates) - i) // (i + 1)
+        if sets <= max_exhaustive_sets:
+            return list(min(combinations(candidates, num), key=self.set_cost))
+        # grow a set from each gpu by adding the cheapest gpu each time.
+        best = None
+        for start in candidates:
+            selected = [start]
+            while len(selected) < num:
+                rest = [gpu for gpu in candidates if gpu not in selected]
+                selected.append(min(rest, key=lambda gpu:self.set_cost(selected + [gpu])))
+            if best is None or self.set_cost(selected) < self.set_cost(best):
+                best = selected
+        return best